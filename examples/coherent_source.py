@@ -4,7 +4,7 @@ Coherent Source example
 It produces coherent state in a mode, the mode needs to be given on port 'input'
 """
 from qsi.qsi import QSI
-from qsi.helpers import numpy_to_json, pretty_print_dict
+from qsi.helpers import kraus_to_json, pretty_print_dict
 from qsi.state import State, StateProp
 import time
 import numpy as np
@@ -102,7 +102,7 @@ def channel_query(msg):
 
     return {
         "msg_type": "channel_query_response",
-        "kraus_operators": [numpy_to_json(x) for x in kraus_operators],
+        "kraus_operators": kraus_to_json(kraus_operators),
         "kraus_state_indices": [uuid],
         "error": error,
         "retrigger": False,
@@ -7,7 +7,7 @@ on how such device should be implemented in the scope of the special issue.
 """
 
 from qsi.qsi import QSI
-from qsi.helpers import numpy_to_json, pretty_print_dict
+from qsi.helpers import kraus_to_json, pretty_print_dict
 from qsi.state import State, StateProp
 
 import uuid
@@ -115,7 +115,7 @@ if __name__ == "__main__":
 
         return {
             "msg_type" : "channel_query_response",
-            "kraus_operators" : [ numpy_to_json(op) for op in operators],
+            "kraus_operators" : kraus_to_json(operators),
             "kraus_state_indices" : [str(state_uuid)],
             "error" : 0,
             "operation_time" : signal.width,
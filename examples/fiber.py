@@ -6,7 +6,7 @@ It returns a Kraus operators which attenuate the state of the given mode,
 according to the given refractive index and length.
 """
 from qsi.qsi import QSI
-from qsi.helpers import numpy_to_json, pretty_print_dict
+from qsi.helpers import kraus_to_json, pretty_print_dict
 from qsi.state import State, StateProp
 import time
 import numpy as np
@@ -40,6 +40,8 @@ def param_query(msg):
     """
     return {
         "msg_type": "param_query_response",
+        # Only the props of the ports are read
+        "state_input": "props",
         "params" : {
             "length": "number",
             "n": "number"
@@ -114,7 +116,7 @@ def channel_query(msg):
 
     return {
         "msg_type": "channel_query_response",
-        "kraus_operators": [numpy_to_json(x) for x in kraus_operators],
+        "kraus_operators": kraus_to_json(kraus_operators),
         "kraus_state_indices": [uuid],
         "error": 0,
         "retrigger": False,
@@ -37,6 +37,8 @@ def param_query(msg):
     """
     return {
         "msg_type": "param_query_response",
+        # Only the props of the ports are read
+        "state_input": "props",
         "params" : {
             "n_ports": "number",
             "n": "number",
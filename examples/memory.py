@@ -4,7 +4,7 @@ Simple Memory example
 It stores a photon in memory.
 """
 from qsi.qsi import QSI
-from qsi.helpers import numpy_to_json, pretty_print_dict
+from qsi.helpers import kraus_to_json, pretty_print_dict
 from qsi.state import State, StateProp
 import time
 import numpy as np
@@ -120,7 +120,7 @@ def channel_query(msg):
     # Construct message
     return {
         "msg_type": "channel_query_response",
-        "kraus_operators": [numpy_to_json(x) for x in kraus_operators],
+        "kraus_operators": kraus_to_json(kraus_operators),
         "kraus_state_indices": kraus_indices,
         "error": 0,
         "retrigger": retrigger,
@@ -6,11 +6,11 @@ exciton level, biexciton level). This memory is unlikely to be excited to the st
 so in the simulation we neglect the state, which produces some error.
 """
 from qsi.qsi import QSI
-from qsi.helpers import numpy_to_json, pretty_print_dict
+from qsi.helpers import kraus_to_json, pretty_print_dict
 from qsi.state import State, StateProp
+from qsi import metrics
 import time
 import numpy as np
-from scipy.linalg import sqrtm
 import uuid
 
 qsi = QSI()
@@ -235,12 +235,7 @@ def channel_query(msg):
     enlarged_state = np.zeros_like(reduced_state_copy)
     enlarged_state[:state.shape[0],:state.shape[1]] = state
 
-    fidelity = np.abs(np.trace(
-        sqrtm(
-            sqrtm(reduced_state_copy) @ enlarged_state @ sqrtm(reduced_state_copy)
-        )
-    ))
-    fidelity = fidelity**2
+    fidelity = metrics.fidelity(reduced_state_copy, enlarged_state)
 
     # decide on retriggering possibility and time
     retrigger = False
@@ -252,7 +247,7 @@ def channel_query(msg):
     # Construct message
     return {
         "msg_type": "channel_query_response",
-        "kraus_operators": [numpy_to_json(x) for x in kraus_operators],
+        "kraus_operators": kraus_to_json(kraus_operators),
         "kraus_state_indices": kraus_indices,
         "error": float(error),
         "retrigger": retrigger,
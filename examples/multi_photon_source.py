@@ -4,7 +4,7 @@ Multi-photon source example
 It produces state of multiple photons in a mode, the mode needs to be given on port 'input' 
 """
 from qsi.qsi import QSI
-from qsi.helpers import numpy_to_json, pretty_print_dict
+from qsi.helpers import kraus_to_json, pretty_print_dict
 from qsi.state import State, StateProp
 import time
 import numpy as np
@@ -32,6 +32,8 @@ def param_query(msg):
     """
     return {
         "msg_type": "param_query_response",
+        # Only the props of the ports are read
+        "state_input": "props",
         "params" : {
             "n_photons": "number",
             "wavelength": "number",
@@ -89,7 +91,7 @@ def channel_query(msg):
 
     return {
         "msg_type": "channel_query_response",
-        "kraus_operators": [numpy_to_json(x) for x in kraus_operators],
+        "kraus_operators": kraus_to_json(kraus_operators),
         "kraus_state_indices": [uuid],
         "error": 0,
         "retrigger": False,
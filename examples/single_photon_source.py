@@ -4,7 +4,7 @@ Single Photon Source example
 It produces one photon in a mode, the mode needs to be given on port 'input' 
 """
 from qsi.qsi import QSI
-from qsi.helpers import numpy_to_json, pretty_print_dict
+from qsi.helpers import kraus_to_json, pretty_print_dict
 from qsi.state import State, StateProp
 import time
 import numpy as np
@@ -28,7 +28,9 @@ def param_query(msg):
     declares only example parameter 'test'
     """
     return {
-        "msg_type": "param_query_response"
+        "msg_type": "param_query_response",
+        # Only the props of the port are read
+        "state_input": "props"
     }
 
 @qsi.on_message("param_set")
@@ -72,7 +74,7 @@ def channel_query(msg):
 
     return {
         "msg_type": "channel_query_response",
-        "kraus_operators": [numpy_to_json(x) for x in kraus_operators],
+        "kraus_operators": kraus_to_json(kraus_operators),
         "kraus_state_indices": [uuid],
         "error": 0,
         "retrigger": False,
@@ -0,0 +1,208 @@
+"""
+Batched quantum state
+
+Parameter sweeps (fiber lengths, source amplitudes, ...) evolve many states
+of the same product space with the same sequence of channels, only the
+Kraus operators differ. `BatchState` stores such an ensemble with a leading
+batch axis and applies a channel to all members with a single vectorized
+contraction, the Kraus operators can be shared by all members or given per
+member.
+"""
+from typing import Optional
+
+import numpy as np
+
+from qsi.state import State, StateProp
+from qsi.contraction import (
+    get_plan, apply_to_vector_batch, apply_kraus_to_batch,
+    reorder_vector_batch, reorder_density_batch,
+    reduce_vector_batch, reduce_density_batch
+)
+from qsi.precision import get_dtype
+
+
+class BatchState:
+    """
+    Batch of `batch_size` states over the same `state_props`. The batch is
+    held as state vectors of shape (B, D) for as long as only single Kraus
+    operator channels are applied, and as density matrices of shape
+    (B, D, D) afterwards.
+    """
+    def __init__(self, state_prop: Optional[StateProp] = None, batch_size: int = 1,
+                 empty=False):
+        self.batch_size = batch_size
+        self.vectors = None
+        self.matrices = None
+        if not empty:
+            self.state_props = [state_prop]
+            self.vectors = np.zeros((batch_size, state_prop.truncation),
+                                    dtype=get_dtype())
+            self.vectors[:, 0] = 1
+            self.dimensions = state_prop.truncation
+
+    @classmethod
+    def from_states(cls, states: list[State]) -> "BatchState":
+        """
+        Stacks states, which need to share the same spaces, into a batch
+        """
+        batch = cls(batch_size=len(states), empty=True)
+        batch.state_props = list(states[0].state_props)
+        batch.dimensions = states[0].dimensions
+        if all(s.is_pure for s in states):
+            batch.vectors = np.stack([s.vector for s in states])
+        else:
+            batch.matrices = np.stack([s._density_matrix() for s in states])
+        return batch
+
+    @property
+    def is_pure(self) -> bool:
+        return self.matrices is None
+
+    @property
+    def dims(self) -> tuple[int, ...]:
+        return tuple(p.truncation for p in self.state_props)
+
+    @property
+    def state(self) -> np.ndarray:
+        """
+        Density matrices of the batch, of shape (B, D, D)
+        """
+        if self.is_pure:
+            self.promote()
+        return self.matrices
+
+    def promote(self):
+        """
+        Turns the batch of state vectors into a batch of density matrices
+        """
+        if self.is_pure:
+            self.matrices = np.einsum("bi,bj->bij", self.vectors, self.vectors.conj())
+            self.vectors = None
+
+    def __getitem__(self, index: int) -> State:
+        """
+        Member of the batch as a `State`
+        """
+        state = State(empty=True)
+        state.state_props = list(self.state_props)
+        state.dimensions = self.dimensions
+        if self.is_pure:
+            vector = self.vectors[index]
+            state.state = np.outer(vector, vector.conj())
+        else:
+            state.state = self.matrices[index].copy()
+        return state
+
+    def _broadcast(self, batch_size: int):
+        """
+        Repeats the single member of the batch `batch_size` times
+        """
+        if self.is_pure:
+            self.vectors = np.repeat(self.vectors, batch_size, axis=0)
+        else:
+            self.matrices = np.repeat(self.matrices, batch_size, axis=0)
+        self.batch_size = batch_size
+
+    def get_index(self, uuid: str) -> int:
+        return [x.uuid for x in self.state_props].index(uuid)
+
+    def get_props(self, uuid) -> StateProp:
+        return [x for x in self.state_props if x.uuid == uuid][0]
+
+    def get_all_props(self, uuids) -> list[StateProp]:
+        uuid_to_prop = {x.uuid: x for x in self.state_props}
+        return [uuid_to_prop[uuid] for uuid in uuids if uuid in uuid_to_prop]
+
+    def join(self, other: "BatchState"):
+        """
+        Member-wise tensor product, a batch of size one is broadcast
+        """
+        if 1 not in (self.batch_size, other.batch_size) and \
+                self.batch_size != other.batch_size:
+            raise ValueError(
+                f"Batch sizes {self.batch_size} and {other.batch_size} do not match")
+        if self.is_pure and other.is_pure:
+            vectors = self.vectors[:, :, None]*other.vectors[:, None, :]
+            self.vectors = vectors.reshape(vectors.shape[0], -1)
+        else:
+            self.promote()
+            other.promote()
+            matrices = (self.matrices[:, :, None, :, None] *
+                        other.matrices[:, None, :, None, :])
+            dim = self.dimensions*other.dimensions
+            self.matrices = matrices.reshape(matrices.shape[0], dim, dim)
+        self.batch_size = max(self.batch_size, other.batch_size)
+        self.state_props.extend(other.state_props)
+        self.dimensions *= other.dimensions
+
+    def _reorder(self, new_prop_order: list[StateProp]):
+        """
+        Reorders the spaces in the product space
+        """
+        remove_set = set([p.uuid for p in new_prop_order])
+        new_order = [p.uuid for p in new_prop_order] + [
+            prop.uuid for prop in self.state_props if prop.uuid not in remove_set
+        ]
+        uuids = [p.uuid for p in self.state_props]
+        plan = get_plan(self.dims, tuple(uuids.index(u) for u in new_order))
+        if self.is_pure:
+            self.vectors = reorder_vector_batch(plan, self.vectors)
+        else:
+            self.matrices = reorder_density_batch(plan, self.matrices)
+        self.state_props = self.get_all_props(new_order)
+
+    def _plan(self, spaces: list[StateProp]):
+        uuids = [p.uuid for p in self.state_props]
+        return get_plan(self.dims, tuple(uuids.index(p.uuid) for p in spaces))
+
+    def apply_kraus_operators(self, operators: list,
+                              operation_spaces: list[StateProp]):
+        """
+        Applies a set of Kraus operators to all members of the batch.
+
+        Parameters
+        ----------
+        operators : list
+            Kraus operators, each either of shape (dt, dt) and shared by the
+            whole batch, or of shape (B, dt, dt) with one operator per member.
+
+        operation_spaces : list[StateProp]
+            Spaces on which the Kraus operators act, in the order of the
+            spaces in the operators.
+
+        Notes
+        -----
+        - The whole batch is transformed in a single batched contraction.
+        - A pure batch stays pure when a single Kraus operator is applied.
+        """
+        for p in operation_spaces:
+            assert p in self.state_props
+        dtype = self.vectors.dtype if self.is_pure else self.matrices.dtype
+        operators = np.stack([np.asarray(K, dtype=dtype) for K in operators])
+        per_member = operators.ndim == 4
+        if per_member:
+            if self.batch_size == 1:
+                self._broadcast(operators.shape[1])
+            if operators.shape[1] != self.batch_size:
+                raise ValueError(
+                    f"Expected operators for {self.batch_size} members, "
+                    f"received {operators.shape[1]}")
+            operators = operators.transpose(1, 0, 2, 3)
+        plan = self._plan(operation_spaces)
+        if self.is_pure and operators.shape[-3] == 1:
+            operator = operators[:, 0] if per_member else operators[0]
+            self.vectors = apply_to_vector_batch(plan, operator, self.vectors)
+            return
+        self.promote()
+        self.matrices = apply_kraus_to_batch(plan, operators, self.matrices)
+
+    def get_reduced_state(self, spaces: list[StateProp]) -> np.ndarray:
+        """
+        Reduced density matrices of the given spaces, of shape (B, d, d). The
+        kept spaces retain the order they have in the state.
+        """
+        uid = set([x.uuid for x in spaces])
+        plan = self._plan([p for p in self.state_props if p.uuid in uid])
+        if self.is_pure:
+            return reduce_vector_batch(plan, self.vectors)
+        return reduce_density_batch(plan, self.matrices)
@@ -0,0 +1,178 @@
+"""
+Photon number block representation of density matrices
+
+The basis of a product space of Fock truncated light modes splits into
+sectors of equal total photon number. Number conserving channels (beam
+splitters, couplers, phase shifts) never mix these sectors, so the density
+matrix can be stored as a set of blocks labeled by the total photon numbers
+(N, M) of the rows and columns, and the Kraus operators can be applied one
+block at a time. Internal (non light) subsystems carry no photons.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+from qsi.contraction import ContractionPlan, PLAN_CACHE_SIZE, basis_permutation
+
+
+# Operator elements coupling different sectors below this value are ignored
+CONSERVATION_TOLERANCE = 1e-12
+
+
+def photon_numbers(props) -> tuple[tuple[int, ...], ...]:
+    """
+    Photon number of each basis state, for each of the subsystems
+    """
+    return tuple(
+        tuple(range(p.truncation)) if p.state_type == "light"
+        else (0,)*p.truncation
+        for p in props
+    )
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def total_numbers(numbers: tuple[tuple[int, ...], ...]) -> np.ndarray:
+    """
+    Total photon number of each basis state of the product space
+    """
+    total = np.zeros(1, dtype=int)
+    for n in numbers:
+        total = (total[:, None] + np.asarray(n, dtype=int)[None, :]).reshape(-1)
+    return total
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def sectors(numbers: tuple[tuple[int, ...], ...]) -> dict[int, np.ndarray]:
+    """
+    Basis indices of each total photon number sector
+    """
+    total = total_numbers(numbers)
+    return {int(N): np.flatnonzero(total == N) for N in np.unique(total)}
+
+
+def is_number_conserving(operators: np.ndarray,
+                         numbers: tuple[tuple[int, ...], ...]) -> bool:
+    """
+    True if none of the operators couples different photon number sectors
+    of the space they act on
+    """
+    total = total_numbers(numbers)
+    mixing = total[:, None] != total[None, :]
+    scale = max(np.abs(operators).max(initial=0), 1)
+    return bool(np.all(np.abs(operators[:, mixing]) <= CONSERVATION_TOLERANCE*scale))
+
+
+class PhotonBlocks:
+    """
+    Density matrix stored as blocks labeled by the total photon numbers of
+    rows and columns, blocks which are zero are not stored
+    """
+    def __init__(self, numbers, blocks: dict, dtype=complex):
+        self.numbers = numbers
+        self.blocks = blocks
+        self.dtype = dtype
+
+    @property
+    def dims(self) -> tuple[int, ...]:
+        return tuple(len(n) for n in self.numbers)
+
+    @property
+    def shape(self) -> tuple[int, int]:
+        dim = int(np.prod(self.dims))
+        return (dim, dim)
+
+    @classmethod
+    def from_dense(cls, numbers, rho: np.ndarray) -> "PhotonBlocks":
+        idcs = sectors(numbers)
+        blocks = {}
+        for N, rows in idcs.items():
+            for M, cols in idcs.items():
+                block = rho[np.ix_(rows, cols)]
+                if np.any(block):
+                    blocks[(N, M)] = block
+        return cls(numbers, blocks, rho.dtype)
+
+    @classmethod
+    def from_vector(cls, numbers, vector: np.ndarray) -> "PhotonBlocks":
+        parts = {N: vector[idx] for N, idx in sectors(numbers).items()
+                 if np.any(vector[idx])}
+        blocks = {(N, M): np.outer(v, w.conj())
+                  for N, v in parts.items() for M, w in parts.items()}
+        return cls(numbers, blocks, vector.dtype)
+
+    def to_dense(self) -> np.ndarray:
+        idcs = sectors(self.numbers)
+        rho = np.zeros(self.shape, dtype=self.dtype)
+        for (N, M), block in self.blocks.items():
+            rho[np.ix_(idcs[N], idcs[M])] = block
+        return rho
+
+    def trace(self) -> complex:
+        return sum(np.trace(b) for (N, M), b in self.blocks.items() if N == M)
+
+    def hermiticity_error(self) -> float:
+        """
+        Frobenius norm of rho - rho^dagger
+        """
+        error = 0.0
+        for (N, M), block in self.blocks.items():
+            mirror = self.blocks.get((M, N))
+            mirror = 0 if mirror is None else mirror.conj().T
+            error += np.linalg.norm(block - mirror)**2
+        return float(np.sqrt(error))
+
+    def __mul__(self, value) -> "PhotonBlocks":
+        return PhotonBlocks(self.numbers, {k: b*value for k, b in self.blocks.items()},
+                            self.dtype)
+
+    def __truediv__(self, value) -> "PhotonBlocks":
+        return self*(1/value)
+
+    def _split_indices(self, plan: ContractionPlan) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Target and rest index of every basis state, in the plan's layout
+        """
+        position = np.argsort(basis_permutation(plan))
+        return np.divmod(position, plan.d_rest)
+
+    def apply_kraus(self, plan: ContractionPlan, operators: np.ndarray) -> "PhotonBlocks":
+        """
+        Applies number conserving Kraus operators, each operator restricted
+        to a sector is applied to the blocks of that sector
+        """
+        target, rest = self._split_indices(plan)
+        restricted = {}
+        for N, idx in sectors(self.numbers).items():
+            t, r = target[idx], rest[idx]
+            restricted[N] = operators[:, t[:, None], t[None, :]] * (r[:, None] == r[None, :])
+        blocks = {}
+        for (N, M), block in self.blocks.items():
+            K_N, K_M = restricted[N], restricted[M]
+            new_block = np.matmul(np.matmul(K_N, block), K_M.conj().transpose(0, 2, 1))
+            blocks[(N, M)] = new_block.sum(axis=0)
+        return PhotonBlocks(self.numbers, blocks, np.result_type(operators, self.dtype))
+
+    def reorder(self, plan: ContractionPlan) -> "PhotonBlocks":
+        """
+        Reorders the subsystems into the order of the plan
+        """
+        source = basis_permutation(plan)
+        numbers = tuple(self.numbers[i] for i in plan.perm)
+        old, new = sectors(self.numbers), sectors(numbers)
+        position = {N: np.searchsorted(old[N], source[new[N]]) for N in new}
+        blocks = {(N, M): b[np.ix_(position[N], position[M])]
+                  for (N, M), b in self.blocks.items()}
+        return PhotonBlocks(numbers, blocks, self.dtype)
+
+    def reduce(self, plan: ContractionPlan) -> np.ndarray:
+        """
+        Reduced density matrix of the targeted subsystems
+        """
+        target, rest = self._split_indices(plan)
+        idcs = sectors(self.numbers)
+        reduced = np.zeros((plan.d_target, plan.d_target), dtype=self.dtype)
+        for (N, M), block in self.blocks.items():
+            rows, cols = np.nonzero(rest[idcs[N]][:, None] == rest[idcs[M]][None, :])
+            np.add.at(reduced, (target[idcs[N]][rows], target[idcs[M]][cols]),
+                      block[rows, cols])
+        return reduced
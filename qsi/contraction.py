@@ -0,0 +1,273 @@
+"""
+Contraction plans for operations on product space states
+
+A plan captures the axis bookkeeping required to bring a set of subsystems
+of a product space state to the front, so that operators can be applied with
+plain matrix multiplication. Plans only depend on the subsystem dimensions and
+on the positions of the targeted subsystems, they are memoized so that the
+same channel layout applied repeatedly reuses the same plan.
+"""
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+
+PLAN_CACHE_SIZE = 256
+# Bound on the number of elements of the stacked intermediates of the
+# batched Kraus contraction, the Kraus set is applied in chunks below it
+MAX_BATCH_ELEMENTS = 2**24
+
+
+@dataclass(frozen=True)
+class ContractionPlan:
+    dims: tuple[int, ...]
+    targets: tuple[int, ...]
+    perm: tuple[int, ...]
+    inverse: tuple[int, ...]
+    d_target: int
+    d_rest: int
+
+    @property
+    def permuted_dims(self) -> tuple[int, ...]:
+        return tuple(self.dims[i] for i in self.perm)
+
+    @property
+    def density_perm(self) -> tuple[int, ...]:
+        n = len(self.dims)
+        return self.perm + tuple(n + i for i in self.perm)
+
+    @property
+    def density_inverse(self) -> tuple[int, ...]:
+        n = len(self.dims)
+        return self.inverse + tuple(n + i for i in self.inverse)
+
+    @property
+    def liouville_perm(self) -> tuple[int, ...]:
+        """
+        Axes order (targets, targets, rest, rest) used by the superoperator
+        """
+        n, t = len(self.dims), len(self.targets)
+        perm = self.perm
+        return perm[:t] + tuple(n + i for i in perm[:t]) + perm[t:] + tuple(
+            n + i for i in perm[t:])
+
+    @property
+    def liouville_inverse(self) -> tuple[int, ...]:
+        return tuple(int(i) for i in np.argsort(self.liouville_perm))
+
+    def prefers_superoperator(self, n_operators: int) -> bool:
+        """
+        Compares the operation count of applying the Kraus set one operator
+        at a time (2 k dt^3 dr^2) with building and applying the
+        superoperator (k dt^4 + dt^4 dr^2)
+        """
+        dt, dr = self.d_target, self.d_rest
+        return dt*(dr*dr + n_operators) < 2*n_operators*dr*dr
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def get_plan(dims: tuple[int, ...], targets: tuple[int, ...]) -> ContractionPlan:
+    """
+    Returns the (memoized) plan, which moves the `targets` subsystems,
+    in the given order, in front of the remaining subsystems
+    """
+    rest = tuple(i for i in range(len(dims)) if i not in targets)
+    perm = tuple(targets) + rest
+    inverse = tuple(int(i) for i in np.argsort(perm))
+    d_target = int(np.prod([dims[i] for i in targets], dtype=np.int64))
+    d_rest = int(np.prod([dims[i] for i in rest], dtype=np.int64))
+    return ContractionPlan(tuple(dims), tuple(targets), perm, inverse,
+                           d_target, d_rest)
+
+
+def clear_plan_cache():
+    get_plan.cache_clear()
+    basis_permutation.cache_clear()
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def basis_permutation(plan: ContractionPlan) -> np.ndarray:
+    """
+    Flat basis index in the original order, for each basis state in the
+    (targets, rest) order of the plan
+    """
+    dim = plan.d_target*plan.d_rest
+    return np.arange(dim).reshape(plan.dims).transpose(plan.perm).reshape(-1)
+
+
+def apply_to_vector(plan: ContractionPlan, operator: np.ndarray,
+                    vector: np.ndarray) -> np.ndarray:
+    """
+    Applies the operator to the targeted subsystems of a state vector
+    """
+    psi = vector.reshape(plan.dims).transpose(plan.perm)
+    psi = operator @ psi.reshape(plan.d_target, plan.d_rest)
+    psi = psi.reshape(plan.permuted_dims).transpose(plan.inverse)
+    return psi.reshape(-1)
+
+
+def apply_to_density(plan: ContractionPlan, operator: np.ndarray,
+                     rho: np.ndarray) -> np.ndarray:
+    """
+    Computes K rho K^dagger, where K acts on the targeted subsystems
+    """
+    dt, dr = plan.d_target, plan.d_rest
+    x = rho.reshape(plan.dims*2).transpose(plan.density_perm)
+    # Left multiplication acts on the row indices of the target spaces
+    x = operator @ x.reshape(dt, dr*dt*dr)
+    # Right multiplication by K^dagger acts on the column indices
+    x = np.matmul(operator.conj(), x.reshape(dt*dr, dt, dr))
+    x = x.reshape(plan.permuted_dims*2).transpose(plan.density_inverse)
+    return x.reshape(rho.shape)
+
+
+def apply_kraus_to_density(plan: ContractionPlan, operators: np.ndarray,
+                           rho: np.ndarray) -> np.ndarray:
+    """
+    Computes sum_k K_k rho K_k^dagger for a stacked Kraus set of shape
+    (k, dt, dt), the cheaper of the batched Kraus contraction and the
+    superoperator (Liouville) contraction is used. The batched contraction
+    processes as many operators at once as fit in `MAX_BATCH_ELEMENTS`.
+    """
+    if plan.prefers_superoperator(operators.shape[0]):
+        return apply_superoperator(plan, superoperator(operators), rho)
+    dt, dr = plan.d_target, plan.d_rest
+    rho_t = rho.reshape(plan.dims*2).transpose(plan.density_perm)
+    rho_t = rho_t.reshape(1, dt, dr*dt*dr)
+    chunk = max(1, MAX_BATCH_ELEMENTS // rho.size)
+    x = np.zeros((dt*dr, dt, dr), dtype=np.result_type(operators, rho))
+    for i in range(0, operators.shape[0], chunk):
+        ops = operators[i:i + chunk]
+        # Batched left multiplication, one slice per Kraus operator
+        y = np.matmul(ops, rho_t)
+        y = np.matmul(ops.conj()[:, None], y.reshape(-1, dt*dr, dt, dr))
+        x += y.sum(axis=0)
+    x = x.reshape(plan.permuted_dims*2).transpose(plan.density_inverse)
+    return x.reshape(rho.shape)
+
+
+def superoperator(operators: np.ndarray) -> np.ndarray:
+    """
+    Superoperator sum_k K_k (x) K_k^* of a stacked Kraus set, acting on the
+    row-major vectorized target block of the density matrix
+    """
+    dt = operators.shape[-1]
+    S = np.einsum("kab,kcd->acbd", operators, operators.conj(), optimize=True)
+    return S.reshape(dt*dt, dt*dt)
+
+
+def apply_superoperator(plan: ContractionPlan, S: np.ndarray,
+                        rho: np.ndarray) -> np.ndarray:
+    """
+    Applies a superoperator to the targeted subsystems of a density matrix
+    """
+    dt, dr = plan.d_target, plan.d_rest
+    perm = plan.liouville_perm
+    x = rho.reshape(plan.dims*2).transpose(perm)
+    x = S @ x.reshape(dt*dt, dr*dr)
+    x = x.reshape([(plan.dims*2)[i] for i in perm]).transpose(plan.liouville_inverse)
+    return x.reshape(rho.shape)
+
+
+def reorder_vector(plan: ContractionPlan, vector: np.ndarray) -> np.ndarray:
+    """
+    Reorders the state vector into the order of the plan
+    """
+    return vector.reshape(plan.dims).transpose(plan.perm).reshape(-1)
+
+
+def reorder_density(plan: ContractionPlan, rho: np.ndarray) -> np.ndarray:
+    """
+    Reorders the density matrix into the order of the plan
+    """
+    x = rho.reshape(plan.dims*2).transpose(plan.density_perm)
+    return x.reshape(rho.shape)
+
+
+def reduce_vector(plan: ContractionPlan, vector: np.ndarray) -> np.ndarray:
+    """
+    Reduced density matrix of the targeted subsystems of a state vector
+    """
+    psi = reorder_vector(plan, vector).reshape(plan.d_target, plan.d_rest)
+    return psi @ psi.conj().T
+
+
+def reduce_density(plan: ContractionPlan, rho: np.ndarray) -> np.ndarray:
+    """
+    Reduced density matrix of the targeted subsystems, the remaining
+    subsystems are traced out
+    """
+    dt, dr = plan.d_target, plan.d_rest
+    x = rho.reshape(plan.dims*2).transpose(plan.density_perm)
+    return np.trace(x.reshape(dt, dr, dt, dr), axis1=1, axis2=3)
+
+
+def _batched(perm: tuple[int, ...]) -> tuple[int, ...]:
+    """
+    Axis permutation which keeps a leading batch axis in place
+    """
+    return (0,) + tuple(1 + i for i in perm)
+
+
+def apply_to_vector_batch(plan: ContractionPlan, operator: np.ndarray,
+                          vectors: np.ndarray) -> np.ndarray:
+    """
+    Applies a shared (dt, dt) or per batch (B, dt, dt) operator to a batch
+    of state vectors of shape (B, D)
+    """
+    B = vectors.shape[0]
+    psi = vectors.reshape((B,) + plan.dims).transpose(_batched(plan.perm))
+    psi = np.matmul(operator, psi.reshape(B, plan.d_target, plan.d_rest))
+    psi = psi.reshape((B,) + plan.permuted_dims).transpose(_batched(plan.inverse))
+    return psi.reshape(B, -1)
+
+
+def apply_kraus_to_batch(plan: ContractionPlan, operators: np.ndarray,
+                         rho: np.ndarray) -> np.ndarray:
+    """
+    Computes sum_k K_k rho_b K_k^dagger for a batch of density matrices of
+    shape (B, D, D), with a shared (k, dt, dt) or a per batch (B, k, dt, dt)
+    Kraus set, in a single batched contraction
+    """
+    B = rho.shape[0]
+    dt, dr = plan.d_target, plan.d_rest
+    if operators.ndim == 3:
+        operators = operators[None]
+    x = rho.reshape((B,) + plan.dims*2).transpose(_batched(plan.density_perm))
+    x = np.matmul(operators, x.reshape(B, 1, dt, dr*dt*dr))
+    x = np.matmul(operators.conj()[:, :, None], x.reshape(B, -1, dt*dr, dt, dr))
+    x = x.sum(axis=1)
+    x = x.reshape((B,) + plan.permuted_dims*2).transpose(_batched(plan.density_inverse))
+    return x.reshape(rho.shape)
+
+
+def reorder_vector_batch(plan: ContractionPlan, vectors: np.ndarray) -> np.ndarray:
+    B = vectors.shape[0]
+    x = vectors.reshape((B,) + plan.dims).transpose(_batched(plan.perm))
+    return x.reshape(vectors.shape)
+
+
+def reorder_density_batch(plan: ContractionPlan, rho: np.ndarray) -> np.ndarray:
+    B = rho.shape[0]
+    x = rho.reshape((B,) + plan.dims*2).transpose(_batched(plan.density_perm))
+    return x.reshape(rho.shape)
+
+
+def reduce_vector_batch(plan: ContractionPlan, vectors: np.ndarray) -> np.ndarray:
+    """
+    Reduced density matrices of the targeted subsystems, for a batch of
+    state vectors
+    """
+    psi = reorder_vector_batch(plan, vectors).reshape(-1, plan.d_target, plan.d_rest)
+    return psi @ psi.conj().transpose(0, 2, 1)
+
+
+def reduce_density_batch(plan: ContractionPlan, rho: np.ndarray) -> np.ndarray:
+    """
+    Reduced density matrices of the targeted subsystems, for a batch of
+    density matrices
+    """
+    dt, dr = plan.d_target, plan.d_rest
+    x = reorder_density_batch(plan, rho)
+    return np.trace(x.reshape(-1, dt, dr, dt, dr), axis1=2, axis2=4)
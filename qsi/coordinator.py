@@ -57,6 +57,8 @@ class Coordinator(SocketHandler):
         mr = self.get_module_reference(message["sent_from"])[2]
         match message["msg_type"]:
             case "param_query_response":
+                mr.notify_wire_formats(message.get("wire_formats", ["json"]))
+                mr.notify_state_input(message.get("state_input", "full"))
                 if "params" in message.keys():
                     mr.notify_params(message["params"])
 
@@ -64,6 +66,9 @@ class Coordinator(SocketHandler):
             self.response_received = True
             self.condition.notify()
 
+    def wire_formats(self, port):
+        return self.get_module_reference(port)[2].wire_formats
+
     def send_to(self, port, message):
         with self.condition:
             while not self.response_received:
@@ -1,39 +1,63 @@
 import numpy as np
 import json
 
+from qsi.precision import get_dtype
+
 def numpy_to_json(matrix):
     """
-    Converts a NumPy matrix with complex numbers into a JSON-serializable format.
+    Converts a NumPy array with complex numbers into a JSON-serializable format.
 
     Parameters:
-    matrix (numpy.ndarray): A matrix with complex numbers.
+    matrix (numpy.ndarray): An array (of any dimension) with complex numbers.
 
     Returns:
-    list: A JSON-serializable list format of the matrix.
+    list: A JSON-serializable nested list, where every element is replaced
+    by the pair [real, imag].
     """
-    json_serializable_matrix = matrix.tolist()
-    for i in range(len(json_serializable_matrix)):
-        for j in range(len(json_serializable_matrix[i])):
-            json_serializable_matrix[i][j] = [json_serializable_matrix[i][j].real, json_serializable_matrix[i][j].imag]
-    return json_serializable_matrix
+    matrix = np.asarray(matrix)
+    return np.stack([matrix.real, matrix.imag], axis=-1).tolist()
 
 
 def json_to_numpy(json_matrix):
     """
-    Converts a JSON-serializable list format back into a NumPy matrix with complex numbers.
+    Converts a JSON-serializable list format back into a NumPy array with complex numbers.
 
     Parameters:
-    json_matrix (list): A JSON-serializable list format of the matrix.
+    json_matrix (list): A JSON-serializable nested list of [real, imag] pairs.
+
+    Returns:
+    numpy.ndarray: A NumPy array with complex numbers, in the precision of
+    the simulation (see `qsi.precision`). Arrays received in a binary frame
+    are only converted to that precision.
+    """
+    if isinstance(json_matrix, np.ndarray):
+        return json_matrix.astype(get_dtype(), copy=False)
+    pairs = np.ascontiguousarray(json_matrix, dtype=np.float64)
+    # The trailing [real, imag] axis is reinterpreted as complex128
+    return pairs.view(np.complex128)[..., 0].astype(get_dtype(), copy=False)
+
+
+def kraus_to_json(operators):
+    """
+    Converts a list of Kraus operators (of equal shape) in a single call.
 
     Returns:
-    numpy.ndarray: A NumPy matrix with complex numbers.
-    """
-    complex_matrix = np.empty((len(json_matrix), len(json_matrix[0])), dtype=np.complex128)
-    for i in range(len(json_matrix)):
-        for j in range(len(json_matrix[i])):
-            real_part, imag_part = json_matrix[i][j]
-            complex_matrix[i, j] = complex(real_part, imag_part)
-    return complex_matrix
+    list: A list with the JSON-serializable format of every operator.
+    """
+    if len(operators) == 0:
+        return []
+    return numpy_to_json(np.stack(operators))
+
+
+def json_to_kraus(json_operators):
+    """
+    Converts a JSON list of Kraus operators back into a list of NumPy arrays.
+    """
+    if len(json_operators) == 0:
+        return []
+    if isinstance(json_operators[0], np.ndarray):
+        return [json_to_numpy(K) for K in json_operators]
+    return list(json_to_numpy(json_operators))
 
 def pretty_print_dict(d):
     print(json.dumps(d, indent=4))
@@ -0,0 +1,56 @@
+"""
+Kraus set compression
+
+Two Kraus sets describe the same channel if they have the same Choi matrix
+C = sum_k vec(K_k) vec(K_k)^dagger. The eigendecomposition of the Choi
+matrix yields the minimal Kraus set (of the size of the Choi rank), with
+the operators sqrt(lambda_i) unvec(v_i). Zero, duplicated or linearly
+dependent operators returned by modules are removed this way, which saves
+a contraction of the state per removed operator.
+"""
+import numpy as np
+
+
+# Eigenvalues below this fraction of the largest eigenvalue are dropped
+KRAUS_TOLERANCE = 1e-12
+
+
+def choi_matrix(operators: list) -> np.ndarray:
+    """
+    Choi matrix sum_k vec(K_k) vec(K_k)^dagger, with row-major vectorization
+    """
+    A = np.stack([np.asarray(K) for K in operators]).reshape(len(operators), -1)
+    return A.T @ A.conj()
+
+
+def compress_kraus(operators: list, tolerance: float = None) -> list:
+    """
+    Returns a minimal Kraus set equivalent to `operators`.
+
+    The nonzero spectrum of the Choi matrix C = M M^dagger (M holding the
+    vectorized operators as columns) equals the spectrum of the Gram matrix
+    G = M^dagger M. When there are fewer operators than matrix elements the
+    (smaller) Gram matrix is decomposed, G u_i = lambda_i u_i, and the
+    minimal operators are M u_i = sum_k (u_i)_k K_k, otherwise the Choi
+    matrix itself is decomposed.
+
+    If no operator can be removed, the operators are returned unchanged.
+    """
+    tolerance = KRAUS_TOLERANCE if tolerance is None else tolerance
+    operators = [np.asarray(K) for K in operators]
+    if len(operators) == 0:
+        return operators
+    shape = operators[0].shape
+    M = np.stack(operators).reshape(len(operators), -1).T
+    if len(operators) <= M.shape[0]:
+        w, u = np.linalg.eigh(M.conj().T @ M)
+        keep = w > tolerance*max(w.max(), 0)
+        compressed = (M @ u[:, keep]).T
+    else:
+        w, v = np.linalg.eigh(M @ M.conj().T)
+        keep = w > tolerance*max(w.max(), 0)
+        compressed = (v[:, keep]*np.sqrt(w[keep])).T
+    if len(compressed) >= len(operators):
+        return operators
+    # Largest contributions first
+    return [K.reshape(shape) for K in compressed[::-1]]
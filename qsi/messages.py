@@ -5,6 +5,13 @@ This module is used for message verification
 import jsonschema
 
 
+# Reference to a raw array buffer of a binary frame (see `qsi.wire`)
+array_reference = {
+    "type": "object",
+    "properties": {"__array__": {"type": "integer"}},
+    "required": ["__array__"]
+}
+
 param_query = {
     "msg_type" : {"type": "string", "enum":["param_query"]},
     "sent_from" : "int"
@@ -24,7 +31,13 @@ param_query_response = {
                     "enum": ["integer", "number", "string", "complex"]
                 }
             }
-        }
+        },
+        "wire_formats": {
+            "type": "array",
+            "items": {"type": "string", "enum": ["json", "binary", "shared"]}
+        },
+        # Content of the state in channel queries (see `State.to_message`)
+        "state_input": {"type": "string", "enum": ["props", "reduced", "full"]}
     },
     "required": ["msg_type", "sent_from"],
     "additionalProperties": False
@@ -113,18 +126,23 @@ channel_query_response = {
         "kraus_operators": {
             "type": "array",
             "items": {  # list of operators
-                "type": "array",
-                "items": {  # row of an operator
-                    "type": "array",
-                    "items": {  # column of an operator
+                "anyOf": [
+                    {
                         "type": "array",
-                        "items": {  # element of an operator
-                            "type": "number"
-                        },
-                        "minItems": 2,
-                        "maxItems": 2
-                    }
-                }
+                        "items": {  # row of an operator
+                            "type": "array",
+                            "items": {  # column of an operator
+                                "type": "array",
+                                "items": {  # element of an operator
+                                    "type": "number"
+                                },
+                                "minItems": 2,
+                                "maxItems": 2
+                            }
+                        }
+                    },
+                    array_reference
+                ]
             }
         },
         "kraus_state_indices": {
@@ -133,6 +151,14 @@ channel_query_response = {
                 "type": "string",
                 "minItems": 1
             }
+        },
+        # Subsystems which are no longer needed after the channel
+        # (absorbed or lost photons), they are traced out by the coordinator
+        "discard_state_indices": {
+            "type": "array",
+            "items": {
+                "type": "string"
+            }
         }
     },
     "anyOf": [
@@ -0,0 +1,88 @@
+"""
+State metrics
+
+Fidelity, trace distance and purity of density matrices, computed from
+Hermitian eigendecompositions instead of matrix square roots. Pure (rank
+one) and diagonal states are handled in closed form, and the
+decomposition of the reference state (the first argument) is cached, so
+that comparing many states with the same reference costs one
+eigendecomposition per comparison.
+"""
+from functools import lru_cache
+
+import numpy as np
+
+
+# Relative tolerance for recognizing pure and diagonal states
+STRUCTURE_TOLERANCE = 1e-12
+REFERENCE_CACHE_SIZE = 16
+
+
+def purity(rho: np.ndarray) -> float:
+    """
+    Purity tr(rho^2) of a density matrix
+    """
+    return float(np.vdot(rho, rho).real)
+
+
+def _is_pure(rho: np.ndarray) -> bool:
+    # A positive matrix has rank one iff tr(rho^2) = tr(rho)^2
+    trace = np.trace(rho).real
+    return abs(purity(rho) - trace**2) <= STRUCTURE_TOLERANCE*max(trace**2, 1)
+
+
+def _is_diagonal(rho: np.ndarray) -> bool:
+    off = rho - np.diag(np.diagonal(rho))
+    return np.linalg.norm(off) <= STRUCTURE_TOLERANCE*max(np.linalg.norm(rho), 1)
+
+
+@lru_cache(maxsize=REFERENCE_CACHE_SIZE)
+def _sqrt_reference(data: bytes, shape: tuple, dtype: str) -> np.ndarray:
+    """
+    Square root of the reference state, memoized on its content
+    """
+    rho = np.frombuffer(data, dtype=dtype).reshape(shape)
+    w, v = np.linalg.eigh(rho)
+    return (v*np.sqrt(np.clip(w, 0, None))) @ v.conj().T
+
+
+def sqrt_reference(rho: np.ndarray) -> np.ndarray:
+    rho = np.ascontiguousarray(rho)
+    return _sqrt_reference(rho.tobytes(), rho.shape, rho.dtype.str)
+
+
+def fidelity(rho: np.ndarray, sigma: np.ndarray) -> float:
+    """
+    Fidelity (tr sqrt(sqrt(rho) sigma sqrt(rho)))^2 of two density matrices
+
+    Notes
+    -----
+    - If either state is pure, the fidelity is tr(rho sigma).
+    - If both states are diagonal, it is the classical fidelity of the
+    diagonals, (sum_i sqrt(p_i q_i))^2.
+    - Otherwise sqrt(rho) is obtained from the (cached) eigendecomposition
+    of rho and the eigenvalues of sqrt(rho) sigma sqrt(rho) are summed.
+    """
+    if _is_pure(rho) or _is_pure(sigma):
+        return float(abs(np.vdot(rho, sigma)))
+    if _is_diagonal(rho) and _is_diagonal(sigma):
+        p = np.clip(np.diagonal(rho).real, 0, None)
+        q = np.clip(np.diagonal(sigma).real, 0, None)
+        return float(np.sum(np.sqrt(p*q))**2)
+    root = sqrt_reference(rho)
+    w = np.linalg.eigvalsh(root @ sigma @ root)
+    return float(np.sum(np.sqrt(np.clip(w, 0, None)))**2)
+
+
+def trace_distance(rho: np.ndarray, sigma: np.ndarray) -> float:
+    """
+    Trace distance 1/2 ||rho - sigma||_1 of two density matrices, for two
+    diagonal states the difference of the diagonals is used and for two
+    normalized pure states it is sqrt(1 - F)
+    """
+    if _is_diagonal(rho) and _is_diagonal(sigma):
+        return float(0.5*np.sum(np.abs(np.diagonal(rho) - np.diagonal(sigma))))
+    if (_is_pure(rho) and _is_pure(sigma) and
+            np.isclose(np.trace(rho).real, 1) and np.isclose(np.trace(sigma).real, 1)):
+        return float(np.sqrt(max(1 - abs(np.vdot(rho, sigma)), 0)))
+    return float(0.5*np.sum(np.abs(np.linalg.eigvalsh(rho - sigma))))
@@ -2,8 +2,9 @@ import subprocess
 import threading
 import sys 
 
-from qsi.helpers import numpy_to_json, json_to_numpy
+from qsi.helpers import json_to_kraus
 from qsi.state import State, StateProp
+from qsi.kraus import compress_kraus
 
 class ModuleReference:
     def __init__(self, module: str, port: int, coordinator_port: int, runtime: str, coordinator: "Coordinator"):
@@ -13,6 +14,10 @@ class ModuleReference:
         self.runtime = runtime
         self.states = []
         self.params = []
+        # Modules which do not declare their wire formats only understand JSON
+        self.wire_formats = ["json"]
+        # Content of the state the module needs in channel queries
+        self.state_input = "full"
         if runtime == "python":
             command = [sys.executable, module, str(port), str(coordinator_port)]
         self.process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True)
@@ -30,6 +35,16 @@ class ModuleReference:
         self.params = {name: {"value":None, "type": param_type} for name, param_type in params.items()}
         print(self.params)
 
+    def notify_wire_formats(self, wire_formats):
+        self.wire_formats = wire_formats
+
+    def notify_state_input(self, state_input):
+        self.state_input = state_input
+
+    @property
+    def binary(self) -> bool:
+        return "binary" in self.wire_formats
+
     def _capture_output(self, stream, stream_name):
         for line in iter(stream.readline, ''):
             print(f"[{stream_name}] {line.strip()}")
@@ -62,16 +77,24 @@ class ModuleReference:
         
     def channel_query(self, state: "State", port_assign, time=0, signals=[]):
         """
-        Queries the module for the Kraus channel
+        Queries the module for the Kraus channel, the returned Kraus set
+        is compressed to its minimal size (see `qsi.kraus`). Subsystems the
+        module lists in `discard_state_indices` are marked as discarded, they
+        are traced out (in one batch) before the state is sent again.
+        Only the content declared by the module in `state_input` is sent.
         """
-        message = state.to_message(port_assign)
+        message = state.to_message(port_assign, binary=self.binary,
+                                   state_input=self.state_input)
         message["msg_type"]="channel_query"
         message["signals"]=signals
         message["time"]=time
         response = self.coordinator.send_and_return_response(self.port, message)
         print(response)
         if "kraus_operators" in response:
-            operators = [json_to_numpy(x) for x in response["kraus_operators"]]
+            operators = json_to_kraus(response["kraus_operators"])
+            operators = compress_kraus(operators)
+        if "discard_state_indices" in response:
+            state.discard(state.get_all_props(response["discard_state_indices"]))
         return response, operators
 
 
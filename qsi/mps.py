@@ -0,0 +1,306 @@
+"""
+Matrix product density operator (MPDO) state
+
+Chains of modes with nearest neighbour coupling (coupler lattices, chains
+of fiber segments) carry limited correlations, which can be represented
+with a matrix product density operator. Every subsystem is a site tensor
+of shape (chi_left, d, d, chi_right), with the ket and the bra index of
+the subsystem in the middle. A channel is applied by contracting the sites
+it acts on (and the sites between them) into a single tensor, applying the
+Kraus operators and splitting the tensor back into sites with truncated
+singular value decompositions.
+
+`MPDOState` mirrors the `State` API (`join`, `apply_kraus_operators`,
+`get_reduced_state`, `discard`/`collect` and `to_message`), so it can be
+passed to `ModuleReference.channel_query`. The bond dimension is bounded by
+`max_bond` and singular values below `cutoff` (relative to the largest)
+are discarded.
+"""
+from typing import Optional
+
+import numpy as np
+
+from qsi.state import State, StateProp, STATE_INPUTS, _port_uuids
+from qsi.contraction import get_plan, reorder_density
+from qsi.precision import get_dtype
+
+
+class MPDOState:
+    """
+    Chain of subsystems stored as a matrix product density operator, the
+    chain order is the order in which the subsystems were joined
+    """
+    def __init__(self, state_prop: Optional[StateProp] = None, empty=False,
+                 max_bond: int = 64, cutoff: float = 1e-12):
+        self.max_bond = max_bond
+        self.cutoff = cutoff
+        self.sites = []
+        self.site_props = []
+        self.state_props = []
+        self.discarded = set()
+        self.dimensions = 1
+        # Accumulated relative weight of the discarded singular values
+        self.truncation_error = 0.0
+        if not empty:
+            d = state_prop.truncation
+            site = np.zeros((1, d, d, 1), dtype=get_dtype())
+            site[0, 0, 0, 0] = 1
+            self.sites = [site]
+            self.site_props = [state_prop]
+            self.state_props = [state_prop]
+            self.dimensions = d
+
+    @classmethod
+    def from_state(cls, state: State, max_bond: int = 64,
+                   cutoff: float = 1e-12) -> "MPDOState":
+        """
+        Decomposes a (small) dense state into a matrix product density operator
+        """
+        mpdo = cls(empty=True, max_bond=max_bond, cutoff=cutoff)
+        mpdo.state_props = list(state.state_props)
+        mpdo.site_props = list(state.state_props)
+        mpdo.dimensions = state.dimensions
+        dims = [p.truncation for p in state.state_props]
+        n = len(dims)
+        # Group the ket and bra index of every subsystem together
+        T = state.state.reshape(dims*2)
+        T = T.transpose([i for j in range(n) for i in (j, n + j)])
+        mpdo.sites = [None]*n
+        mpdo._split(T.reshape([1] + [d for d in dims for _ in range(2)] + [1]), 0, n - 1)
+        return mpdo
+
+    @property
+    def state_props(self) -> list[StateProp]:
+        """
+        Subsystems in the logical order, the list should be replaced rather
+        than modified in place, so that the uuid index stays up to date
+        """
+        return self._state_props
+
+    @state_props.setter
+    def state_props(self, value: list[StateProp]):
+        self._state_props = list(value)
+        self._index = {p.uuid: i for i, p in enumerate(self._state_props)}
+        self._props = {p.uuid: p for p in self._state_props}
+
+    @property
+    def site_props(self) -> list[StateProp]:
+        """
+        Subsystems in the chain order, replaced rather than modified in place
+        """
+        return self._site_props
+
+    @site_props.setter
+    def site_props(self, value: list[StateProp]):
+        self._site_props = list(value)
+        self._sites = {p.uuid: i for i, p in enumerate(self._site_props)}
+
+    def get_index(self, uuid: str) -> int:
+        return self._index[uuid]
+
+    def get_props(self, uuid) -> StateProp:
+        return self._props[uuid]
+
+    def get_all_props(self, uuids) -> list[StateProp]:
+        return [self._props[uuid] for uuid in uuids if uuid in self._props]
+
+    def _site_index(self, uuid: str) -> int:
+        return self._sites[uuid]
+
+    @property
+    def bond_dimensions(self) -> list[int]:
+        return [site.shape[3] for site in self.sites[:-1]]
+
+    def join(self, other: "MPDOState"):
+        """
+        Appends the sites of the other chain at the end of this chain
+        """
+        self.sites.extend(other.sites)
+        self.site_props = self.site_props + other.site_props
+        self.state_props = self.state_props + other.state_props
+        self.discarded |= other.discarded
+        self.dimensions *= other.dimensions
+        self.truncation_error += other.truncation_error
+
+    def _reorder(self, new_prop_order: list[StateProp]):
+        """
+        Reorders the spaces in the logical order, the chain is not modified
+        """
+        remove_set = set([p.uuid for p in new_prop_order])
+        new_order = [p.uuid for p in new_prop_order] + [
+            prop.uuid for prop in self.state_props if prop.uuid not in remove_set
+        ]
+        self.state_props = self.get_all_props(new_order)
+
+    def _contract(self, lo: int, hi: int) -> np.ndarray:
+        """
+        Contracts the sites lo..hi into a tensor of shape
+        (chi_left, d_lo, d_lo, ..., d_hi, d_hi, chi_right)
+        """
+        T = self.sites[lo]
+        for i in range(lo + 1, hi + 1):
+            T = np.tensordot(T, self.sites[i], axes=([-1], [0]))
+        return T
+
+    def _split(self, T: np.ndarray, lo: int, hi: int):
+        """
+        Splits the tensor back into the sites lo..hi with truncated SVDs
+        """
+        for i in range(lo, hi):
+            chi_left, d = T.shape[0], T.shape[1]
+            rest = T.shape[3:]
+            U, S, Vh = np.linalg.svd(
+                T.reshape(chi_left*d*d, -1), full_matrices=False)
+            chi = self._bond(S)
+            self.sites[i] = U[:, :chi].reshape(chi_left, d, d, chi)
+            T = (S[:chi, None]*Vh[:chi]).reshape((chi,) + rest)
+        self.sites[hi] = T
+
+    def _bond(self, S: np.ndarray) -> int:
+        """
+        Number of singular values to keep, the discarded weight is recorded
+        """
+        if S[0] == 0:
+            return 1
+        chi = int(np.sum(S > self.cutoff*S[0]))
+        chi = max(1, min(chi, self.max_bond))
+        weight = np.sum(S**2)
+        self.truncation_error += float(np.sum(S[chi:]**2)/weight)
+        return chi
+
+    def apply_kraus_operators(self, operators: list,
+                              operation_spaces: list[StateProp]):
+        """
+        Applies a set of Kraus operators to the given subsystems. The sites
+        between the first and the last targeted site are contracted, so the
+        cost grows with the distance between the targeted sites in the chain.
+        """
+        for p in operation_spaces:
+            assert p.uuid in self._index
+        positions = [self._site_index(p.uuid) for p in operation_spaces]
+        lo, hi = min(positions), max(positions)
+        T = self._contract(lo, hi)
+        local = [i - lo for i in positions]
+        others = [j for j in range(hi - lo + 1) if j not in local]
+        n = hi - lo + 1
+
+        # Bring the axes to (kets of targets, bras of targets, rest)
+        perm = ([1 + 2*j for j in local] + [2 + 2*j for j in local] + [0] +
+                [1 + 2*j for j in others] + [2 + 2*j for j in others] + [2*n + 1])
+        X = T.transpose(perm)
+        permuted_shape = X.shape
+        dt = int(np.prod([T.shape[1 + 2*j] for j in local]))
+        operators = np.stack([np.asarray(K, dtype=T.dtype).reshape(dt, dt)
+                              for K in operators])
+        X = np.matmul(operators, X.reshape(1, dt, -1)).reshape(len(operators), dt, dt, -1)
+        X = np.einsum("kabr,kcb->acr", X, operators.conj(), optimize=True)
+        T = X.reshape(permuted_shape).transpose(np.argsort(perm))
+        self._split(T, lo, hi)
+
+    def discard(self, spaces: list[StateProp]):
+        """
+        Marks subsystems as discarded, they are traced out by the next `collect`
+        """
+        for p in spaces:
+            assert p.uuid in self._index
+            self.discarded.add(p.uuid)
+
+    def collect(self):
+        """
+        Traces out all discarded subsystems, the traced site is absorbed
+        into the next kept site of the chain (the previous one at the end
+        of the chain), so the bond dimensions do not grow
+        """
+        if not self.discarded:
+            return
+        sites, site_props = [], []
+        pending = None
+        for site, prop in zip(self.sites, self.site_props):
+            if prop.uuid in self.discarded:
+                M = np.trace(site, axis1=1, axis2=2)
+                pending = M if pending is None else pending @ M
+                continue
+            if pending is not None:
+                site = np.tensordot(pending, site, axes=([1], [0]))
+                pending = None
+            sites.append(site)
+            site_props.append(prop)
+        if pending is not None and sites:
+            sites[-1] = np.tensordot(sites[-1], pending, axes=([3], [0]))
+        for p in self.state_props:
+            if p.uuid in self.discarded:
+                self.dimensions //= p.truncation
+        self.sites = sites
+        self.site_props = site_props
+        self.state_props = [p for p in self.state_props if p.uuid not in self.discarded]
+        self.discarded = set()
+
+    def trace(self) -> complex:
+        R = np.ones(1, dtype=self.sites[0].dtype)
+        for site in self.sites:
+            R = R @ np.trace(site, axis1=1, axis2=2)
+        return R[0]
+
+    def get_reduced_state(self, spaces: list[StateProp]) -> np.ndarray:
+        """
+        Returns the reduced density matrix of the given spaces, the
+        remaining sites are traced out while contracting the chain. The kept
+        spaces retain the order they have in the state.
+        """
+        uid = set([x.uuid for x in spaces])
+        R = np.ones(1, dtype=self.sites[0].dtype)
+        kept = []
+        for site, prop in zip(self.sites, self.site_props):
+            if prop.uuid in uid:
+                R = np.tensordot(R, site, axes=([-1], [0]))
+                kept.append(prop)
+            else:
+                R = np.tensordot(R, np.trace(site, axis1=1, axis2=2), axes=([-1], [0]))
+        R = R[..., 0]
+        dims = tuple(p.truncation for p in kept)
+        n = len(kept)
+        dim = int(np.prod(dims))
+        rho = R.transpose([2*j for j in range(n)] + [2*j + 1 for j in range(n)])
+        rho = rho.reshape(dim, dim)
+        order = [p for p in self.state_props if p.uuid in uid]
+        position = {p.uuid: i for i, p in enumerate(kept)}
+        plan = get_plan(dims, tuple(position[p.uuid] for p in order))
+        return reorder_density(plan, rho)
+
+    @property
+    def state(self) -> np.ndarray:
+        """
+        Dense density matrix in the order of `state_props`, only feasible
+        for small chains
+        """
+        return self.get_reduced_state(self.state_props)
+
+    def to_state(self) -> State:
+        """
+        Converts the chain into a dense `State`
+        """
+        s = State(empty=True)
+        s.state_props = list(self.state_props)
+        s.state = self.state
+        s.dimensions = self.dimensions
+        return s
+
+    def to_message(self, port_assign=None, msg_type="channel_query", binary=False,
+                   state_input="full"):
+        """
+        Serializes the state like `State.to_message`, the chain is only
+        contracted as far as the selected `state_input` requires
+        """
+        if state_input not in STATE_INPUTS:
+            raise ValueError(f"Unknown state input {state_input}, expected one of {STATE_INPUTS}")
+        self.collect()
+        if state_input == "full":
+            state = self.to_state()
+        else:
+            ports = set(_port_uuids(port_assign))
+            state = State(empty=True)
+            state.state_props = [p for p in self.state_props if p.uuid in ports]
+            state.dimensions = int(np.prod([p.truncation for p in state.state_props]))
+            if state_input == "reduced":
+                state.state = self.get_reduced_state(state.state_props)
+        return state.to_message(port_assign, msg_type, binary, state_input)
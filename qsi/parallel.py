@@ -0,0 +1,116 @@
+"""
+Multi-threaded Kraus operator application
+
+numpy releases the GIL inside its matrix products, so the application of a
+Kraus set to a large density matrix can be spread over a thread pool. The
+output is partitioned into blocks of rows of the remaining (non targeted)
+subsystems, which only depend on the same rows of the input; if there are
+fewer remaining basis states than threads, the Kraus set is partitioned
+instead and the partial sums are reduced. With the superoperator
+contraction the columns of the Liouville space matrix are partitioned.
+
+The number of threads is set with `set_threads`, the default of one thread
+keeps the serial kernels of `qsi.contraction`. The working memory of all
+threads together stays within `contraction.MAX_BATCH_ELEMENTS`, as for the
+serial kernel.
+"""
+from concurrent.futures import ThreadPoolExecutor
+import os
+
+import numpy as np
+
+from qsi import contraction
+from qsi.contraction import (
+    ContractionPlan, apply_kraus_to_density, superoperator
+)
+
+
+THREADS = 1
+# Density matrices with fewer elements are processed serially
+MIN_PARALLEL_ELEMENTS = 2**16
+
+_pool = None
+
+
+def set_threads(threads: int = None, min_elements: int = None):
+    """
+    Sets the number of threads used to apply Kraus operators, None uses
+    all cores
+    """
+    global THREADS, MIN_PARALLEL_ELEMENTS, _pool
+    if threads is None:
+        threads = os.cpu_count() or 1
+    if threads < 1:
+        raise ValueError(f"Number of threads needs to be positive, received {threads}")
+    if threads != THREADS and _pool is not None:
+        _pool.shutdown()
+        _pool = None
+    THREADS = threads
+    if min_elements is not None:
+        MIN_PARALLEL_ELEMENTS = min_elements
+
+
+def get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=THREADS, thread_name_prefix="qsi-kraus")
+    return _pool
+
+
+def use_parallel(rho) -> bool:
+    return THREADS > 1 and rho.shape[0]*rho.shape[1] >= MIN_PARALLEL_ELEMENTS
+
+
+def _partition(n: int, parts: int) -> list[slice]:
+    bounds = np.linspace(0, n, min(parts, n) + 1).astype(int)
+    return [slice(a, b) for a, b in zip(bounds[:-1], bounds[1:]) if b > a]
+
+
+def apply_kraus_parallel(plan: ContractionPlan, operators: np.ndarray,
+                         rho: np.ndarray) -> np.ndarray:
+    """
+    Computes sum_k K_k rho K_k^dagger for a stacked Kraus set, on `THREADS`
+    threads
+    """
+    dt, dr = plan.d_target, plan.d_rest
+    pool = get_pool()
+    dtype = np.result_type(operators, rho)
+    if plan.prefers_superoperator(operators.shape[0]):
+        S = superoperator(operators)
+        perm = plan.liouville_perm
+        x = rho.reshape(plan.dims*2).transpose(perm).reshape(dt*dt, dr*dr)
+        out = np.empty(x.shape, dtype=dtype)
+
+        def columns(cols: slice):
+            out[:, cols] = S @ x[:, cols]
+
+        list(pool.map(columns, _partition(dr*dr, THREADS)))
+        out = out.reshape([(plan.dims*2)[i] for i in perm]).transpose(plan.liouville_inverse)
+        return out.reshape(rho.shape)
+
+    # Number of Kraus operators whose stacked intermediates fit in the budget
+    chunk = max(1, contraction.MAX_BATCH_ELEMENTS // rho.size)
+    if dr < THREADS:
+        # Every part works on a full size copy, their number is bounded too
+        parts = pool.map(lambda ops: apply_kraus_to_density(plan, ops, rho),
+                         [operators[s] for s in _partition(len(operators), min(THREADS, chunk))])
+        return sum(parts)
+
+    x = rho.reshape(plan.dims*2).transpose(plan.density_perm).reshape(dt, dr, dt, dr)
+    out = np.empty(x.shape, dtype=dtype)
+
+    def rows(block: slice):
+        n = block.stop - block.start
+        slab = x[:, block].reshape(1, dt, n*dt*dr)
+        acc = np.zeros((dt*n, dt, dr), dtype=dtype)
+        # The slabs of all threads together hold `chunk` full size copies
+        for i in range(0, len(operators), chunk):
+            ops = operators[i:i + chunk]
+            y = np.matmul(ops, slab)
+            y = np.matmul(ops.conj()[:, None], y.reshape(-1, dt*n, dt, dr))
+            acc += y.sum(axis=0)
+        out[:, block] = acc.reshape(dt, n, dt, dr)
+
+    list(pool.map(rows, _partition(dr, THREADS)))
+    out = out.reshape(plan.permuted_dims*2).transpose(plan.density_inverse)
+    return out.reshape(rho.shape)
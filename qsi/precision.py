@@ -0,0 +1,55 @@
+"""
+Numerical precision of the simulation
+
+The precision is set once per simulation (before the states are created)
+and is used by `State`, the Kraus operator application and the
+deserialization of messages. With `check_drift` enabled, every channel
+application checks how far the state drifted from unit trace and from
+being Hermitian, which accumulates faster in single precision.
+"""
+import warnings
+
+import numpy as np
+
+
+PRECISIONS = {
+    "complex128": np.complex128,
+    "complex64": np.complex64,
+}
+
+DTYPE = np.complex128
+CHECK_DRIFT = False
+DRIFT_TOLERANCE = 1e-5
+
+
+class DriftWarning(RuntimeWarning):
+    pass
+
+
+def set_precision(precision: str = "complex128", check_drift: bool = False,
+                  drift_tolerance: float = None):
+    """
+    Sets the precision of the simulation, either 'complex128' or 'complex64'
+    """
+    global DTYPE, CHECK_DRIFT, DRIFT_TOLERANCE
+    if precision not in PRECISIONS:
+        raise ValueError(
+            f"Precision needs to be one of {list(PRECISIONS)}, received {precision}")
+    DTYPE = PRECISIONS[precision]
+    CHECK_DRIFT = check_drift
+    if drift_tolerance is not None:
+        DRIFT_TOLERANCE = drift_tolerance
+
+
+def get_dtype() -> type:
+    return DTYPE
+
+
+def warn_drift(trace_error: float, hermiticity_error: float):
+    """
+    Warns if the drift of the state exceeds the tolerance
+    """
+    if max(trace_error, hermiticity_error) > DRIFT_TOLERANCE:
+        warnings.warn(
+            f"State drifted by {trace_error:.3e} in trace and "
+            f"{hermiticity_error:.3e} in Hermiticity", DriftWarning, stacklevel=3)
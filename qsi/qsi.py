@@ -6,6 +6,7 @@ import struct
 import sys
 
 from qsi.socket_handler import SocketHandler
+from qsi.wire import WIRE_FORMATS
 
 
 class QSI(SocketHandler):
@@ -77,7 +78,8 @@ class QSI(SocketHandler):
         `"msg_type"` key from the message.
 
         If the handler function returns a response, this response is sent to
-        the coordinator via the `send_to` method.
+        the coordinator via the `send_to` method. The wire formats understood
+        by the module are declared in the `param_query_response`.
 
         Args:
             message (dict): A dictionary containing the message data, which
@@ -88,9 +90,15 @@ class QSI(SocketHandler):
             KeyError: If there is no handler registered for the given `msg_type`.
         """
         response = self.message_handlers[message["msg_type"]](message)
+        if response is not None and response["msg_type"] == "param_query_response":
+            response.setdefault("wire_formats", WIRE_FORMATS)
         if response is not None:
             self.send_to(self.coordinator_port, response)
 
+    def wire_formats(self, port: int) -> list[str]:
+        # The coordinator is the local process which started the module
+        return WIRE_FORMATS
+
     def terminate(self):
         """
         Terminate the server.
@@ -0,0 +1,161 @@
+"""
+Shared memory density matrices processed by worker processes
+
+The density matrix is placed in a `multiprocessing.shared_memory` segment,
+which the worker processes attach to by name, so the state is never copied
+into the workers. Kraus operators and partial traces are computed with the
+block kernels of `qsi.streaming`: the basis states of the non targeted
+subsystems are split into chunks, and every worker owns the slab of rows
+belonging to one chunk. A slab is transformed in place, independently of
+the other slabs, and the partial traces of the slabs are summed.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
+from multiprocessing import resource_tracker
+import os
+import weakref
+
+import numpy as np
+
+from qsi.contraction import ContractionPlan
+from qsi import streaming
+
+
+# Number of worker processes, None uses all cores
+PROCESSES = None
+
+_pool = None
+
+
+class SharedArray(np.ndarray):
+    """
+    Array backed by a shared memory segment, the segment is released when
+    the array is garbage collected. Arrays derived from it (views, results
+    of operations) are not considered shared.
+    """
+    def __array_finalize__(self, obj):
+        self.shm = None
+
+
+def set_processes(processes: int = None):
+    """
+    Sets the number of worker processes, None uses all cores
+    """
+    global PROCESSES, _pool
+    if processes is not None and processes < 1:
+        raise ValueError(f"Number of processes needs to be positive, received {processes}")
+    if _pool is not None:
+        _pool.shutdown()
+        _pool = None
+    PROCESSES = processes
+
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=PROCESSES or os.cpu_count() or 1)
+    return _pool
+
+
+def _release(shm: shared_memory.SharedMemory):
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        shm.close()
+    except BufferError:
+        # Still exported by the array being collected, the mapping is
+        # closed when the segment object itself is collected
+        pass
+
+
+def create_shared(shape: tuple[int, int], dtype=complex) -> SharedArray:
+    """
+    Creates a zero initialized matrix in a new shared memory segment
+    """
+    dtype = np.dtype(dtype)
+    size = max(int(np.prod(shape))*dtype.itemsize, 1)
+    shm = shared_memory.SharedMemory(create=True, size=size)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf).view(SharedArray)
+    array[...] = 0
+    array.shm = shm
+    weakref.finalize(array, _release, shm)
+    return array
+
+
+def is_shared(matrix) -> bool:
+    return isinstance(matrix, SharedArray) and matrix.shm is not None
+
+
+def to_shared(matrix) -> SharedArray:
+    out = create_shared(matrix.shape, np.result_type(matrix.dtype, np.complex64))
+    out[...] = matrix
+    return out
+
+
+def _attach(name: str, shape, dtype,
+            untrack: bool) -> tuple[shared_memory.SharedMemory, np.ndarray]:
+    """
+    Attaches a worker to the segment. The segment is owned by the parent
+    process, workers with their own resource tracker (not forked) must not
+    track it, otherwise it is unlinked when the worker exits.
+    """
+    try:
+        shm = shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        shm = shared_memory.SharedMemory(name=name)
+        if untrack:
+            resource_tracker.unregister(shm._name, "shared_memory")
+    return shm, np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+
+
+def _apply_slab(name, shape, dtype, untrack, plan, operators, rows, chunks):
+    shm, rho = _attach(name, shape, dtype, untrack)
+    try:
+        for cols in chunks:
+            streaming.apply_kraus_block(plan, operators, rho, rows, cols)
+    finally:
+        del rho
+        shm.close()
+
+
+def _reduce_slab(name, shape, dtype, untrack, plan, chunk):
+    shm, rho = _attach(name, shape, dtype, untrack)
+    try:
+        return streaming.reduce_block(plan, rho, chunk)
+    finally:
+        del rho
+        shm.close()
+
+
+def _handle(rho: SharedArray) -> tuple:
+    # Forked workers share the resource tracker of the parent
+    untrack = multiprocessing.get_start_method() != "fork"
+    return (rho.shm.name, rho.shape, rho.dtype, untrack)
+
+
+def apply_kraus_shared(plan: ContractionPlan, operators: np.ndarray, rho: SharedArray):
+    """
+    Computes sum_k K_k rho K_k^dagger in place, every worker transforms
+    the slab of rows of one chunk of the remaining subsystems
+    """
+    chunks = streaming.rest_chunks(plan, operators.shape[0] + 1)
+    futures = [get_pool().submit(_apply_slab, *_handle(rho), plan, operators, rows, chunks)
+               for rows in chunks]
+    for f in futures:
+        f.result()
+
+
+def reduce_shared(plan: ContractionPlan, rho: SharedArray) -> np.ndarray:
+    """
+    Reduced density matrix of the targeted subsystems, summed over the
+    partial traces of the slabs
+    """
+    futures = [get_pool().submit(_reduce_slab, *_handle(rho), plan, chunk)
+               for chunk in streaming.rest_chunks(plan)]
+    reduced = np.zeros((plan.d_target, plan.d_target), dtype=rho.dtype)
+    for f in futures:
+        reduced += f.result()
+    return reduced
@@ -1,7 +1,6 @@
 """
 Socket Handler Used by Coordinator and Module
 """
-import json
 from jsonschema import validate
 import socket
 import struct
@@ -9,6 +8,7 @@ import threading
 import time
 
 from qsi.messages import SCHEMAS
+from qsi import wire
 
 
 class SocketHandler:
@@ -57,8 +57,7 @@ class SocketHandler:
                         
                         if not data:
                             break
-                        message = data.decode()
-                        message = json.loads(message)
+                        message = wire.decode(data)
                         self.response_message = message
                         self._router(message)
 
@@ -87,11 +86,25 @@ class SocketHandler:
                 time.sleep(delay)
 
 
+    def wire_formats(self, port: int) -> list[str]:
+        """
+        Wire formats understood by the peer listening on the port
+        """
+        return ["json"]
+
     def send_to(self, port:int, message: dict):
         with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
             s.connect(('localhost', port))
             message["sent_from"] = int(self.listening_port)
-            validate(instance=message, schema=SCHEMAS[message["msg_type"]])
-            json_data = json.dumps(message)
-            message = struct.pack('!I', len(json_data)) + json_data.encode('utf-8')
-            s.sendall(message)
+            # Messages holding numpy arrays are sent as binary frames,
+            # large arrays in shared memory if the peer supports it
+            segments = [] if "shared" in self.wire_formats(port) else None
+            payload, metadata = wire.encode(message, segments)
+            try:
+                validate(instance=metadata, schema=SCHEMAS[message["msg_type"]])
+                message = struct.pack('!I', len(payload)) + payload
+                s.sendall(message)
+            except BaseException:
+                wire.release(segments or [])
+                raise
+            wire.hand_over(segments or [])
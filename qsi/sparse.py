@@ -0,0 +1,130 @@
+"""
+Sparse density matrix kernels
+
+States of Fock truncated modes, produced by banded ladder operators, are
+mostly zero. These kernels implement the state operations on
+`scipy.sparse` matrices, using the same contraction plans as the dense
+kernels in `qsi.contraction`. Instead of reshaping, subsystems are
+permuted with a (memoized) basis permutation matrix.
+"""
+from functools import lru_cache
+
+import numpy as np
+import scipy.sparse as sp
+from scipy.sparse.linalg import norm as sparse_norm
+
+from qsi.contraction import ContractionPlan, PLAN_CACHE_SIZE, basis_permutation
+
+
+# Fraction of non-zero elements above which sparse matrices are made dense
+DENSITY_THRESHOLD = 0.1
+
+
+def is_sparse(matrix) -> bool:
+    return sp.issparse(matrix)
+
+
+def density(matrix) -> float:
+    """
+    Fraction of non-zero elements of a dense or sparse matrix
+    """
+    size = matrix.shape[0]*matrix.shape[1]
+    if sp.issparse(matrix):
+        return matrix.nnz/size
+    return np.count_nonzero(matrix)/size
+
+
+def to_dense(matrix) -> np.ndarray:
+    if sp.issparse(matrix):
+        return matrix.toarray()
+    return matrix
+
+
+def to_sparse(matrix) -> sp.csr_matrix:
+    if sp.issparse(matrix):
+        return matrix.tocsr()
+    return sp.csr_matrix(matrix)
+
+
+def outer(vector: np.ndarray) -> sp.csr_matrix:
+    """
+    Sparse density matrix of a state vector, only the support of the
+    vector is expanded
+    """
+    support = np.flatnonzero(vector)
+    values = vector[support]
+    rows = np.repeat(support, len(support))
+    cols = np.tile(support, len(support))
+    data = np.outer(values, values.conj()).reshape(-1)
+    return sp.csr_matrix((data, (rows, cols)), shape=(len(vector), len(vector)))
+
+
+def kron(a, b):
+    """
+    Tensor product, which stays sparse if any of the inputs is sparse
+    """
+    if sp.issparse(a) or sp.issparse(b):
+        return sp.kron(sp.csr_matrix(a), sp.csr_matrix(b), format="csr")
+    return np.kron(a, b)
+
+
+def norm(matrix) -> float:
+    """
+    Frobenius norm of a dense or sparse matrix
+    """
+    if sp.issparse(matrix):
+        return sparse_norm(matrix)
+    return np.linalg.norm(matrix)
+
+
+@lru_cache(maxsize=PLAN_CACHE_SIZE)
+def permutation_matrix(plan: ContractionPlan) -> sp.csr_matrix:
+    """
+    Permutation P, which maps the basis of the state to the basis ordered as
+    (targets, rest), P rho P^T is the permuted density matrix. P is stored
+    as int8, so that products keep the precision of the density matrix.
+    """
+    dim = plan.d_target*plan.d_rest
+    source = basis_permutation(plan)
+    return sp.csr_matrix((np.ones(dim, dtype=np.int8), (np.arange(dim), source)),
+                         shape=(dim, dim))
+
+
+def reorder_sparse(plan: ContractionPlan, rho) -> sp.csr_matrix:
+    """
+    Reorders the sparse density matrix into the order of the plan
+    """
+    P = permutation_matrix(plan)
+    return (P @ rho @ P.T).tocsr()
+
+
+def apply_kraus_to_sparse(plan: ContractionPlan, operators: np.ndarray,
+                          rho) -> sp.csr_matrix:
+    """
+    Computes sum_k K_k rho K_k^dagger on a sparse density matrix, the
+    operators are extended to the full space as K (x) I in the permuted basis
+    """
+    P = permutation_matrix(plan)
+    identity = sp.identity(plan.d_rest, dtype=np.int8, format="csr")
+    x = P @ rho @ P.T
+    result = sp.csr_matrix(rho.shape, dtype=np.result_type(operators, rho.dtype))
+    for K in operators:
+        K = sp.kron(sp.csr_matrix(K), identity, format="csr")
+        result = result + K @ x @ K.conj().T
+    return (P.T @ result @ P).tocsr()
+
+
+def reduce_sparse(plan: ContractionPlan, rho) -> sp.csr_matrix:
+    """
+    Reduced density matrix of the targeted subsystems of a sparse density
+    matrix, only the non-zero elements on the diagonal of the traced out
+    subsystems contribute
+    """
+    x = (permutation_matrix(plan) @ rho @ permutation_matrix(plan).T).tocoo()
+    t_row, r_row = np.divmod(x.row, plan.d_rest)
+    t_col, r_col = np.divmod(x.col, plan.d_rest)
+    mask = r_row == r_col
+    return sp.csr_matrix(
+        (x.data[mask], (t_row[mask], t_col[mask])),
+        shape=(plan.d_target, plan.d_target)
+    )
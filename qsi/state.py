@@ -1,18 +1,30 @@
 """
 Simple Quantum State Handler
 """
-from dataclasses import dataclass, field, asdict
+from dataclasses import dataclass, field, replace
 import numpy as np
 from typing import Literal, Optional
 import uuid
-import itertools
 
 from type_enforced import Enforcer
 
 from qsi.helpers import numpy_to_json, json_to_numpy
-
-
-@dataclass
+from qsi.contraction import (
+    ContractionPlan, get_plan, apply_to_vector, apply_kraus_to_density,
+    reorder_vector, reorder_density, reduce_vector, reduce_density
+)
+from qsi import sparse as sparse_ops
+from qsi.blocks import PhotonBlocks, photon_numbers, is_number_conserving
+from qsi import streaming
+from qsi import precision
+from qsi import parallel
+from qsi import shared as shared_ops
+
+# Content of the state in channel queries, declared by the modules
+STATE_INPUTS = ["props", "reduced", "full"]
+
+
+@dataclass(frozen=True, slots=True)
 class StateProp:
     state_type: Literal["light", "internal"]
     truncation: int
@@ -22,122 +34,825 @@ class StateProp:
     bandwidth: Optional[float] = field(default=None)
 
     def __post_init__(self):
+        # Frozen dataclass, the normalized fields are set through object
         if self.uuid is None:
-            self.uuid = str(uuid.uuid4())
+            object.__setattr__(self, "uuid", str(uuid.uuid4()))
         if self.state_type == "light":
             if self.wavelength is None:
                 raise ValueError("Wavelength needs to be set for light type")
-            self.wavelength = float(self.wavelength)
+            object.__setattr__(self, "wavelength", float(self.wavelength))
             if self.polarization is None:
                 raise ValueError("Polarization needs to be set for light type")
             if self.bandwidth is None:
                 raise ValueError("Bandwidth needs to be set for light type")
-            self.bandwidth = float(self.bandwidth)
+            object.__setattr__(self, "bandwidth", float(self.bandwidth))
         if self.truncation is None:
             raise ValueError("Truncation needs to be set for all state types")
-        self.truncation = int(self.truncation)
+        object.__setattr__(self, "truncation", int(self.truncation))
+
+    def __hash__(self):
+        # The uuid identifies the subsystem, equal props share the uuid
+        return hash(self.uuid)
+
     def dict(self):
-        return {k: str(v) for k, v in asdict(self).items()}
+        return {k: str(getattr(self, k)) for k in self.__slots__}
+
+
+def _resize_axes(x: np.ndarray, axes: list[int], n: int) -> np.ndarray:
+    """
+    Truncates or zero pads the given axes to length n
+    """
+    for axis in axes:
+        d = x.shape[axis]
+        if n < d:
+            x = np.take(x, np.arange(n), axis=axis)
+        elif n > d:
+            pad = [(0, 0)]*x.ndim
+            pad[axis] = (0, n - d)
+            x = np.pad(x, pad)
+    return x
+
+
+def _dense(matrix) -> np.ndarray:
+    """
+    Dense copy of a density matrix in any of the storage formats
+    """
+    if isinstance(matrix, PhotonBlocks):
+        return matrix.to_dense()
+    return sparse_ops.to_dense(matrix)
+
+
+def _marginal_estimates(plan: ContractionPlan, rho: np.ndarray,
+                        trace) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Reduced states of the (single) target of the plan and of the rest,
+    read off single diagonal blocks of rho: for a product state
+    rho = rho_space x rho_rest / trace, the block of the rest basis state r
+    is rho_space rho_rest[r, r] / trace. The blocks with the largest weight
+    are used, only the diagonal and two blocks of rho are read.
+    """
+    dt, dr = plan.d_target, plan.d_rest
+    x = rho.reshape(plan.dims*2).transpose(plan.density_perm)
+    rest_dims = plan.permuted_dims[1:]
+    diagonal = np.diagonal(rho).reshape(plan.dims).transpose(plan.perm).reshape(dt, dr).real
+    p_space, p_rest = diagonal.sum(axis=1), diagonal.sum(axis=0)
+    a = int(np.argmax(p_space))
+    r = np.unravel_index(int(np.argmax(p_rest)), rest_dims)
+    rho_space = x[(slice(None),) + r + (slice(None),) + r]*trace/p_rest.max()
+    rho_rest = np.take(x[a], a, axis=len(rest_dims)).reshape(dr, dr)*trace/p_space[a]
+    return rho_space, rho_rest
+
+
+def _is_product(plan: ContractionPlan, rho: np.ndarray, rho_space: np.ndarray,
+                rho_rest: np.ndarray, trace, tolerance: float) -> bool:
+    """
+    Checks ||rho - rho_space x rho_rest / trace|| <= tolerance ||rho||
+    (Frobenius norm), where rho_space is the reduced state of the (single)
+    target of the plan. The rows are compared in blocks of at most
+    `streaming.MAX_BLOCK_ELEMENTS` elements of a view of rho, so that neither
+    the reordered matrix nor the product is built, and the comparison stops
+    at the first blocks exceeding the tolerance.
+    """
+    dt = plan.d_target
+    x = rho.reshape(plan.dims*2).transpose(plan.density_perm)
+    # Leading rest axes are iterated, the trailing ones form the row block
+    rest_dims = plan.permuted_dims[1:]
+    j, m = len(rest_dims), 1
+    while j > 0 and m*rest_dims[j - 1]*dt*plan.d_rest <= streaming.MAX_BLOCK_ELEMENTS:
+        j -= 1
+        m *= rest_dims[j]
+    flat = rho.reshape(-1)
+    bound = (tolerance**2)*np.vdot(flat, flat).real
+    row_shape = (1,)*(len(rest_dims) - j) + (dt,) + (1,)*len(rest_dims)
+    rest_shape = rest_dims[j:] + (1,) + rest_dims
+    distance = 0.0
+    for a in range(dt):
+        row = rho_space[a].reshape(row_shape)/trace
+        for s, prefix in enumerate(np.ndindex(*rest_dims[:j])):
+            diff = x[(a,) + prefix] - row*rho_rest[s*m:(s + 1)*m].reshape(rest_shape)
+            distance += np.vdot(diff, diff).real
+            if distance > bound:
+                return False
+    return True
+
+
+def _port_uuids(port_assign) -> list[str]:
+    """
+    Uuids assigned to the ports, a port is assigned a uuid or a list of uuids
+    """
+    uuids = []
+    for value in (port_assign or {}).values():
+        uuids.extend([value] if isinstance(value, str) else value)
+    return uuids
+
+
+class Factor:
+    """
+    Independent factor of a product state, it holds either a state vector
+    or a density matrix of its subsystems (in the order of `props`).
+
+    A `sparse` factor stores its density matrix as a `scipy.sparse` matrix,
+    until the fraction of non-zero elements crosses
+    `qsi.sparse.DENSITY_THRESHOLD`, then it switches to dense storage.
+
+    A `photon_blocks` factor stores its density matrix as blocks of equal
+    total photon number (see `qsi.blocks`), until a channel which does not
+    conserve the photon number is applied, then it switches to dense storage.
+
+    An `out_of_core` factor stores its density matrix in a memory mapped
+    file and processes it block by block (see `qsi.streaming`).
+
+    A `shared` factor stores its density matrix in shared memory, Kraus
+    operators and partial traces are computed by worker processes, each
+    owning a slab of the matrix (see `qsi.shared`).
+    """
+    def __init__(self, props: list[StateProp], vector=None, matrix=None,
+                 sparse=False, photon_blocks=False, out_of_core=False,
+                 shared=False):
+        self.props = props
+        self.vector = vector
+        self.matrix = matrix
+        self.sparse = sparse
+        self.photon_blocks = photon_blocks
+        self.out_of_core = out_of_core
+        self.shared = shared
+        self._update_storage()
+
+    @property
+    def storage(self) -> dict:
+        """
+        Storage flags of the factor, passed on to factors split off from it
+        """
+        return {"sparse": self.sparse, "photon_blocks": self.photon_blocks,
+                "out_of_core": self.out_of_core, "shared": self.shared}
+
+    def _update_storage(self):
+        """
+        Stores the density matrix in the format selected for the factor,
+        a sparse factor switches to dense storage if the matrix became too dense
+        """
+        if self.matrix is None:
+            return
+        if self.photon_blocks:
+            if not isinstance(self.matrix, PhotonBlocks):
+                self.matrix = PhotonBlocks.from_dense(
+                    photon_numbers(self.props), _dense(self.matrix))
+            return
+        if self.out_of_core:
+            if not streaming.is_memmap(self.matrix):
+                self.matrix = streaming.to_memmap(_dense(self.matrix))
+            return
+        if self.shared:
+            if not shared_ops.is_shared(self.matrix):
+                self.matrix = shared_ops.to_shared(_dense(self.matrix))
+            return
+        if not self.sparse:
+            return
+        if sparse_ops.density(self.matrix) > sparse_ops.DENSITY_THRESHOLD:
+            self.matrix = sparse_ops.to_dense(self.matrix)
+            self.sparse = False
+        elif not sparse_ops.is_sparse(self.matrix):
+            self.matrix = sparse_ops.to_sparse(self.matrix)
+
+    @property
+    def props(self) -> list[StateProp]:
+        return self._props
+
+    @props.setter
+    def props(self, value: list[StateProp]):
+        self._props = value
+        self._positions = {p.uuid: i for i, p in enumerate(value)}
+
+    @property
+    def dims(self) -> tuple[int, ...]:
+        return tuple(p.truncation for p in self.props)
+
+    @property
+    def is_pure(self) -> bool:
+        return self.vector is not None
+
+    def __contains__(self, uuid: str) -> bool:
+        return uuid in self._positions
+
+    @property
+    def dtype(self):
+        if self.is_pure:
+            return self.vector.dtype
+        return self.matrix.dtype
+
+    def index(self, uuid: str) -> int:
+        return self._positions[uuid]
+
+    def plan(self, spaces: list[StateProp]) -> ContractionPlan:
+        """
+        Returns the contraction plan targeting the given spaces in the given order
+        """
+        return get_plan(self.dims, tuple(self.index(p.uuid) for p in spaces))
+
+    def density_matrix(self) -> np.ndarray:
+        """
+        Returns the density matrix without promoting the factor
+        """
+        if self.vector is not None:
+            if self.photon_blocks:
+                return PhotonBlocks.from_vector(photon_numbers(self.props), self.vector)
+            if self.out_of_core:
+                return streaming.outer(self.vector)
+            if self.sparse:
+                return sparse_ops.outer(self.vector)
+            return np.outer(self.vector, self.vector.conj())
+        return self.matrix
+
+    def promote(self):
+        """
+        Promotes a pure factor to a density matrix
+        """
+        if self.vector is not None:
+            self.matrix = self.density_matrix()
+            self.vector = None
+            self._update_storage()
+
+    def merge(self, other: "Factor"):
+        """
+        Absorbs the other factor through the tensor product
+        """
+        if self.is_pure and other.is_pure:
+            self.vector = np.kron(self.vector, other.vector)
+            self.props = self.props + other.props
+            return
+        a, b = self.density_matrix(), other.density_matrix()
+        if isinstance(a, PhotonBlocks) or isinstance(b, PhotonBlocks):
+            a, b = _dense(a), _dense(b)
+        self.sparse = self.sparse or other.sparse
+        self.photon_blocks = self.photon_blocks or other.photon_blocks
+        self.out_of_core = self.out_of_core or other.out_of_core
+        self.shared = (self.shared or other.shared) and not self.out_of_core
+        if self.out_of_core:
+            self.matrix = streaming.kron(_dense(a), _dense(b))
+        else:
+            self.matrix = sparse_ops.kron(a, b)
+        self.vector = None
+        self.props = self.props + other.props
+        self._update_storage()
+
+    def reorder(self, new_props: list[StateProp]):
+        """
+        Physically reorders the subsystems of the factor
+        """
+        if [p.uuid for p in new_props] == [p.uuid for p in self.props]:
+            return
+        plan = self.plan(new_props)
+        if self.is_pure:
+            self.vector = reorder_vector(plan, self.vector)
+        elif isinstance(self.matrix, PhotonBlocks):
+            self.matrix = self.matrix.reorder(plan)
+        elif streaming.is_memmap(self.matrix):
+            self.matrix = streaming.reorder_streaming(plan, self.matrix)
+        elif sparse_ops.is_sparse(self.matrix):
+            self.matrix = sparse_ops.reorder_sparse(plan, self.matrix)
+        else:
+            self.matrix = reorder_density(plan, self.matrix)
+        self.props = list(new_props)
+
+    def apply(self, operators: list, spaces: list[StateProp]):
+        """
+        Applies the Kraus operators to the given spaces of the factor
+        """
+        plan = self.plan(spaces)
+        # Operators are applied in the precision of the factor
+        dtype = self.dtype
+        if self.is_pure and len(operators) == 1:
+            operator = np.asarray(operators[0], dtype=dtype).reshape(
+                plan.d_target, plan.d_target)
+            self.vector = apply_to_vector(plan, operator, self.vector)
+            return
+        self.promote()
+        if len(operators) == 0:
+            if streaming.is_memmap(self.matrix) or shared_ops.is_shared(self.matrix):
+                self.matrix[:] = 0
+            else:
+                self.matrix = self.matrix * 0
+            return
+        operators = np.stack([
+            np.asarray(K, dtype=dtype).reshape(plan.d_target, plan.d_target)
+            for K in operators
+        ])
+        if streaming.is_memmap(self.matrix):
+            streaming.apply_kraus_streaming(plan, operators, self.matrix)
+            return
+        if shared_ops.is_shared(self.matrix):
+            shared_ops.apply_kraus_shared(plan, operators, self.matrix)
+            return
+        if isinstance(self.matrix, PhotonBlocks):
+            target_numbers = photon_numbers([self.props[i] for i in plan.targets])
+            if is_number_conserving(operators, target_numbers):
+                self.matrix = self.matrix.apply_kraus(plan, operators)
+                return
+            self.matrix = self.matrix.to_dense()
+            self.photon_blocks = False
+        if sparse_ops.is_sparse(self.matrix):
+            self.matrix = sparse_ops.apply_kraus_to_sparse(plan, operators, self.matrix)
+            self._update_storage()
+        elif parallel.use_parallel(self.matrix):
+            self.matrix = parallel.apply_kraus_parallel(plan, operators, self.matrix)
+        else:
+            self.matrix = apply_kraus_to_density(plan, operators, self.matrix)
+
+    def split(self, space: StateProp, tolerance: float) -> Optional["Factor"]:
+        """
+        Splits `space` off into its own factor, if it is in a product state
+        with the remaining subsystems of this factor (within `tolerance`).
+        Returns the new factor or None if the space is correlated. Out of
+        core density matrices are never split.
+        """
+        if len(self.props) == 1 or streaming.is_memmap(self.matrix):
+            return None
+        plan = self.plan([space])
+        if self.is_pure:
+            # Schmidt decomposition, a product state has a single Schmidt value
+            psi = reorder_vector(plan, self.vector).reshape(plan.d_target, plan.d_rest)
+            u, sv, vh = np.linalg.svd(psi, full_matrices=False)
+            weight = np.sum(sv**2)
+            if weight == 0 or np.sum(sv[1:]**2) > tolerance*weight:
+                return None
+            factor = Factor([space], vector=u[:, 0], **self.storage)
+            self.vector = sv[0]*vh[0]
+        else:
+            trace = self.trace()
+            if trace == 0:
+                return None
+            rest = tuple(i for i in range(len(self.props)) if i != plan.targets[0])
+            if sparse_ops.is_sparse(self.matrix):
+                rho_space = self._reduce(plan)
+                rho_rest = self._reduce(get_plan(self.dims, rest))
+                rho = sparse_ops.reorder_sparse(plan, self.matrix)
+                distance = sparse_ops.norm(rho - sparse_ops.kron(rho_space, rho_rest)/trace)
+                if distance > tolerance*sparse_ops.norm(rho):
+                    return None
+            else:
+                # The partial traces are only computed for product states
+                rho = _dense(self.matrix)
+                if not _is_product(plan, rho, *_marginal_estimates(plan, rho, trace),
+                                   trace, tolerance):
+                    return None
+                rho_space = self._reduce(plan)
+                rho_rest = self._reduce(get_plan(self.dims, rest))
+            factor = Factor([space], matrix=_dense(rho_space/trace), **self.storage)
+            self.matrix = rho_rest
+        self.props = [p for p in self.props if p.uuid != space.uuid]
+        self._update_storage()
+        return factor
+
+    def resize(self, prop: StateProp):
+        """
+        Changes the truncation of a subsystem to `prop.truncation`, levels
+        above the new truncation are projected out, new levels are empty
+        """
+        i = self.index(prop.uuid)
+        if self.is_pure:
+            x = _resize_axes(self.vector.reshape(self.dims), [i], prop.truncation)
+            self.vector = x.reshape(-1)
+        else:
+            n = len(self.props)
+            x = _dense(self.matrix).reshape(self.dims*2)
+            x = _resize_axes(x, [i, n + i], prop.truncation)
+            dim = int(np.prod(x.shape[:n]))
+            self.matrix = x.reshape(dim, dim)
+        self.props = [prop if p.uuid == prop.uuid else p for p in self.props]
+        self._update_storage()
+
+    def trace(self) -> complex:
+        if self.is_pure:
+            return np.vdot(self.vector, self.vector)
+        if isinstance(self.matrix, PhotonBlocks):
+            return self.matrix.trace()
+        return self.matrix.diagonal().sum()
+
+    def hermiticity_error(self) -> float:
+        """
+        Frobenius norm of rho - rho^dagger
+        """
+        if self.is_pure:
+            return 0.0
+        if isinstance(self.matrix, PhotonBlocks):
+            return self.matrix.hermiticity_error()
+        if streaming.is_memmap(self.matrix):
+            return streaming.hermiticity_error(self.matrix)
+        return float(sparse_ops.norm(self.matrix - self.matrix.conj().T))
+
+    def reduce(self, spaces: list[StateProp]) -> np.ndarray:
+        """
+        Reduced density matrix of the given spaces in the order of the factor
+        """
+        uid = set([x.uuid for x in spaces])
+        plan = get_plan(self.dims, tuple(
+            i for i, p in enumerate(self.props) if p.uuid in uid))
+        return sparse_ops.to_dense(self._reduce(plan))
+
+    def _reduce(self, plan: ContractionPlan):
+        if self.is_pure:
+            return reduce_vector(plan, self.vector)
+        if isinstance(self.matrix, PhotonBlocks):
+            return self.matrix.reduce(plan)
+        if streaming.is_memmap(self.matrix):
+            return streaming.reduce_streaming(plan, self.matrix)
+        if shared_ops.is_shared(self.matrix):
+            return shared_ops.reduce_shared(plan, self.matrix)
+        if sparse_ops.is_sparse(self.matrix):
+            return sparse_ops.reduce_sparse(plan, self.matrix)
+        return reduce_density(plan, self.matrix)
 
 
 class State:
-    def __init__(self, state_prop=None, empty=False):
+    """
+    Quantum state of a product space of subsystems.
+
+    The state is stored as a list of independent factors, joining two states
+    only concatenates their factors. Factors are merged when a channel acts
+    on subsystems from more than one factor.
+
+    Each factor starts out as a pure state vector (ket) and is kept in this
+    representation for as long as only single Kraus operator channels are
+    applied to it. When a channel with more than one Kraus operator is
+    applied, the factor is promoted to a density matrix.
+
+    After a channel is applied, each of the targeted subsystems which is
+    left in a product state with the rest of its factor (within
+    `split_tolerance`) is split back into its own factor. The check reads
+    the density matrix once (less for correlated subsystems, where it stops
+    at the first deviating block), the partial traces are only computed
+    for subsystems which are split off. Setting `split_tolerance` to None
+    disables the splitting.
+
+    With `truncation_threshold` set, the truncation of the targeted light
+    subsystems is adapted after every channel (see `adapt_truncation`),
+    the discarded population is accumulated in `truncation_error`.
+
+    With `sparse=True` density matrices are stored as `scipy.sparse`
+    matrices for as long as they stay sparse, with `photon_blocks=True` they
+    are stored as photon number blocks for as long as only number conserving
+    channels are applied, with `out_of_core=True` they are stored in
+    memory mapped files and with `shared=True` they are stored in shared
+    memory and processed by worker processes (see `Factor`).
+
+    The state is created in the precision set by `qsi.precision.set_precision`
+    and Kraus operators are applied in the precision of the state. Dense
+    density matrices are processed on the threads set by
+    `qsi.parallel.set_threads`.
+
+    The order of `state_props` is a logical order, each factor keeps its own
+    physical order of subsystems. Accessing `state` (or `vector`)
+    materializes the full product in the order of `state_props` as a single
+    factor, the (dense) density matrix returned by `state` can be modified
+    in place.
+    """
+    split_tolerance = 1e-10
+    truncation_threshold = None
+    max_truncation = None
+
+    def __init__(self, state_prop=None, empty=False, sparse=False,
+                 photon_blocks=False, out_of_core=False, shared=False):
+        self._payload = None
+        self.factors = []
+        self.state_props = []
+        self.discarded = set()
+        self.truncation_error = 0.0
         if not empty:
             self.state_props = [state_prop]
-            self.state = np.zeros((state_prop.truncation, state_prop.truncation), dtype=complex)
-            self.state[0,0] = 1
+            vector = np.zeros(state_prop.truncation, dtype=precision.get_dtype())
+            vector[0] = 1
+            self.factors = [Factor([state_prop], vector=vector, sparse=sparse,
+                                   photon_blocks=photon_blocks,
+                                   out_of_core=out_of_core, shared=shared)]
             self.dimensions = state_prop.truncation
 
+    @property
+    def factors(self) -> list[Factor]:
+        """
+        Factors of the state, a state received in a message is decoded when
+        the factors are first accessed (see `from_message`)
+        """
+        if self._payload is not None:
+            props, payload = self._payload
+            if payload is None:
+                raise ValueError("The message carried no state, only the props "
+                                 "of the subsystems (state_input 'props')")
+            # The matrix is laid out in the order of the props of the message,
+            # the logical order may have changed since
+            self._factors = [Factor(props, matrix=json_to_numpy(payload))]
+            self._payload = None
+        return self._factors
+
+    @factors.setter
+    def factors(self, value: list[Factor]):
+        self._payload = None
+        self._factors = value
+
+    @property
+    def state_props(self) -> list[StateProp]:
+        """
+        Subsystems in the logical order, the list should be replaced rather
+        than modified in place, so that the uuid index stays up to date
+        """
+        return self._state_props
+
+    @state_props.setter
+    def state_props(self, value: list[StateProp]):
+        self._state_props = list(value)
+        self._index = {p.uuid: i for i, p in enumerate(self._state_props)}
+        self._props = {p.uuid: p for p in self._state_props}
+
+    @property
+    def is_pure(self) -> bool:
+        """
+        True if all factors are currently held as state vectors
+        """
+        return all(f.is_pure for f in self.factors)
+
+    @property
+    def vector(self) -> Optional[np.ndarray]:
+        """
+        State vector of a pure state, None if the state is mixed
+        """
+        if not self.is_pure:
+            return None
+        return self._materialize().vector
+
+    @property
+    def state(self) -> np.ndarray:
+        """
+        Density matrix of the state, a pure state is promoted to a density
+        matrix when accessed, so that the returned matrix can be modified in place
+        """
+        factor = self._materialize()
+        factor.promote()
+        if factor.sparse or factor.photon_blocks:
+            factor.matrix = _dense(factor.matrix)
+            factor.sparse = False
+            factor.photon_blocks = False
+        return factor.matrix
+
+    @state.setter
+    def state(self, value: np.ndarray):
+        self.factors = [Factor(list(self.state_props), matrix=value,
+                               sparse=sparse_ops.is_sparse(value))]
+
+    def _materialize(self) -> Factor:
+        """
+        Merges all factors into a single factor in the order of `state_props`
+        """
+        factor = self.factors[0]
+        for other in self.factors[1:]:
+            factor.merge(other)
+        factor.reorder(self.state_props)
+        self.factors = [factor]
+        return factor
+
+    def _density_matrix(self) -> np.ndarray:
+        """
+        Returns the density matrix without promoting or merging the factors
+        """
+        if len(self.factors) == 1:
+            factor = self.factors[0]
+        else:
+            factor = Factor([], matrix=np.ones((1, 1), dtype=precision.get_dtype()))
+            for f in self.factors:
+                factor.merge(f)
+        factor = Factor(factor.props, factor.vector, factor.matrix)
+        factor.reorder(self.state_props)
+        return _dense(factor.density_matrix())
+
+    def _state_vector(self) -> Optional[np.ndarray]:
+        """
+        Returns the state vector of a pure state without merging the
+        factors, None if the state is mixed
+        """
+        if not self.is_pure:
+            return None
+        factor = Factor([], vector=np.ones(1, dtype=precision.get_dtype()))
+        for f in self.factors:
+            factor.merge(f)
+        factor.reorder(self.state_props)
+        return factor.vector
+
+    def _factor_index(self, uuid: str) -> int:
+        for i, f in enumerate(self.factors):
+            if uuid in f:
+                return i
+        raise ValueError(f"{uuid} is not in the state")
+
+    def _merge_factors(self, spaces: list[StateProp]) -> Factor:
+        """
+        Merges the factors holding the given spaces into a single factor
+        """
+        idcs = sorted(set(self._factor_index(p.uuid) for p in spaces))
+        factor = self.factors[idcs[0]]
+        for i in idcs[1:]:
+            factor.merge(self.factors[i])
+        self.factors = [f for i, f in enumerate(self.factors) if i not in idcs[1:]]
+        return factor
+
+    def _split_factors(self, spaces: list[StateProp]):
+        """
+        Splits the given spaces off their factors, if they are uncorrelated
+        """
+        if self.split_tolerance is None:
+            return
+        for p in spaces:
+            i = self._factor_index(p.uuid)
+            factor = self.factors[i].split(p, self.split_tolerance)
+            if factor is not None:
+                self.factors.insert(i, factor)
+
+    def drift(self) -> tuple[float, float]:
+        """
+        Returns the deviation of the trace from one and the deviation
+        of the density matrix from being Hermitian (Frobenius norm)
+        """
+        trace = np.prod([f.trace() for f in self.factors])
+        return float(abs(trace - 1)), max(f.hermiticity_error() for f in self.factors)
+
+    def adapt_truncation(self, spaces: list[StateProp] = None, threshold: float = None,
+                         max_truncation: int = None) -> dict[str, float]:
+        """
+        Adapts the truncation of light subsystems to their population.
+
+        The populated levels are the lowest levels, for which the population
+        of the levels above stays below `threshold` (relative to the trace),
+        a subsystem is truncated to its populated levels and one empty guard
+        level. If the population of the highest level exceeds the threshold,
+        the truncation grows by one level, up to `max_truncation` (no growth
+        if None). The props of resized subsystems are replaced
+        by props with the same uuid and the new truncation.
+
+        Returns the discarded population of every truncated subsystem.
+        """
+        threshold = self.truncation_threshold if threshold is None else threshold
+        max_truncation = self.max_truncation if max_truncation is None else max_truncation
+        spaces = self.state_props if spaces is None else spaces
+        discarded = {}
+        for space in spaces:
+            p = self.get_props(space.uuid)
+            if p.state_type != "light":
+                continue
+            factor = self.factors[self._factor_index(p.uuid)]
+            populations = np.diagonal(factor.reduce([p])).real
+            trace = populations.sum()
+            if trace <= 0:
+                continue
+            # Population above each level n: tails[n] = sum_{m >= n} p_m
+            tails = np.cumsum(populations[::-1])[::-1]/trace
+            if tails[-1] > threshold:
+                if max_truncation is None or p.truncation >= max_truncation:
+                    continue
+                truncation = p.truncation + 1
+            else:
+                truncation = int(np.argmax(tails <= threshold)) + 1
+                if truncation >= p.truncation:
+                    continue
+                discarded[p.uuid] = float(tails[truncation]*trace)
+                self.truncation_error += discarded[p.uuid]
+            new = replace(p, truncation=truncation)
+            factor.resize(new)
+            self.dimensions = self.dimensions // p.truncation * truncation
+            self.state_props = [new if q.uuid == p.uuid else q for q in self.state_props]
+        return discarded
+
+    def factorize(self):
+        """
+        Splits every subsystem, which is uncorrelated with the rest of its
+        factor, into its own factor
+        """
+        self._split_factors(self.state_props)
+
+    def discard(self, spaces: list[StateProp]):
+        """
+        Marks subsystems as discarded, they are traced out together with
+        the other marked subsystems by the next `collect`
+        """
+        for p in spaces:
+            assert p.uuid in self._index
+            self.discarded.add(p.uuid)
+
+    def collect(self):
+        """
+        Traces out all discarded subsystems and drops their props. Every
+        factor is reduced with a single partial trace, factors holding only
+        discarded subsystems are removed and their trace is carried over to
+        the remaining state.
+        """
+        if not self.discarded:
+            return
+        factors = []
+        scale = 1
+        for f in self.factors:
+            kept = [p for p in f.props if p.uuid not in self.discarded]
+            if len(kept) == len(f.props):
+                factors.append(f)
+            elif not kept:
+                scale *= f.trace()
+            else:
+                factors.append(Factor(kept, matrix=f.reduce(kept), sparse=f.sparse,
+                                      photon_blocks=f.photon_blocks,
+                                      out_of_core=f.out_of_core, shared=f.shared))
+        if factors and scale != 1:
+            factor = factors[0]
+            if factor.is_pure:
+                factor.vector = factor.vector*np.sqrt(scale)
+            else:
+                factor.matrix = factor.matrix*scale
+                factor._update_storage()
+        elif not factors:
+            factors = [Factor([], matrix=np.full((1, 1), scale, dtype=precision.get_dtype()))]
+        for p in self.state_props:
+            if p.uuid in self.discarded:
+                self.dimensions //= p.truncation
+        self.factors = factors
+        self.state_props = [p for p in self.state_props if p.uuid not in self.discarded]
+        self.discarded = set()
+
     def join(self, other: "State"):
-        self.state = np.kron(self.state, other.state)
-        self.state_props.extend(other.state_props)
+        self.factors.extend(other.factors)
+        self.discarded |= other.discarded
+        # The index is extended instead of being rebuilt
+        offset = len(self._state_props)
+        for i, p in enumerate(other.state_props):
+            self._index[p.uuid] = offset + i
+            self._props[p.uuid] = p
+        self._state_props.extend(other.state_props)
         self.dimensions *= other.dimensions
         other = None
 
-    def to_message(self, port_assign=None, msg_type="channel_query"):
+    def to_message(self, port_assign=None, msg_type="channel_query", binary=False,
+                   state_input="full"):
+        """
+        Serializes the state, with `binary=True` the density matrix is kept
+        as an array, which is sent as a raw buffer (see `qsi.wire`).
+
+        `state_input` selects the content of the message (see `STATE_INPUTS`):
+        "full" sends the whole state, "reduced" only the reduced state of the
+        subsystems in `port_assign` and "props" only their props.
+        """
+        if state_input not in STATE_INPUTS:
+            raise ValueError(f"Unknown state input {state_input}, expected one of {STATE_INPUTS}")
+        # Discarded subsystems are not sent to the modules
+        self.collect()
+        if state_input == "full":
+            props = self.state_props
+            rho = self._density_matrix()
+        else:
+            # The reduced state keeps the order of the subsystems in the state
+            ports = set(_port_uuids(port_assign))
+            props = [p for p in self.state_props if p.uuid in ports]
+            rho = self.get_reduced_state(props) if state_input == "reduced" else None
         message = {
-            "dimensions": self.dimensions,
-            "state": numpy_to_json(self.state),
-            "state_props": [x.dict() for x in self.state_props]
+            "dimensions": int(np.prod([p.truncation for p in props])),
+            "state_props": [x.dict() for x in props]
         }
+        if rho is not None:
+            message["state"] = rho if binary else numpy_to_json(rho)
         if port_assign is not None:
             message["ports"]=port_assign
         return message
         
     @classmethod
     def from_message(cls, state_dict: dict):
+        """
+        Creates the state from a message, the props are parsed immediately,
+        the density matrix is decoded lazily when the state is first used,
+        so that handlers which only read the props do not pay for it
+        """
         s = State(empty=True)
-        s.state = json_to_numpy(state_dict["state"])
         s.state_props = [StateProp(**x) for x in state_dict["state_props"]]
         s.dimensions = state_dict["dimensions"]
+        # Props only messages carry no density matrix
+        s._payload = (list(s.state_props), state_dict.get("state"))
         return s
 
     def get_index(self, uuid:str) -> int:
-        ids = [x.uuid for x in self.state_props]
-        return ids.index(uuid)
+        return self._index[uuid]
 
     def get_props(self, uuid) -> StateProp:
-        return [x for x in self.state_props if x.uuid == uuid][0]
+        return self._props[uuid]
 
     def get_all_props(self, uuids) -> list[StateProp]:
-        uuid_to_prop = {x.uuid: x for x in self.state_props}
-        return [uuid_to_prop[uuid] for uuid in uuids if uuid in uuid_to_prop]
+        return [self._props[uuid] for uuid in uuids if uuid in self._props]
 
     @Enforcer
     def _reorder(self, new_prop_order:list[StateProp]):
         """
         Reorders the spaces in the product space
-        """
 
-        dims = [prop.truncation for prop in self.state_props]
-
-        # Figuring out old and new order
-        new_uuids = [p.uuid for p in new_prop_order]
-        current_order = [prop.uuid for prop in self.state_props]
+        Only the logical order (`state_props`) is updated, the factors keep
+        their physical layout. The data is permuted only when the state is
+        materialized in the logical order (`state`, `vector`, `to_message`).
+        """
+        # Figuring out new order, unlisted spaces keep their relative order
         remove_set = set([p.uuid for p in new_prop_order])
-        new_order = [uid for uid in current_order if uid not in remove_set]
-        new_order = [p.uuid for p in new_prop_order] + new_order
-
-
-        indices = {}
-        for uid in current_order:
-            indices[uid] = {
-                1: [],
-                2: []
-            }
-
-        e_start = []
-        counter = itertools.count(start=0)
-
-        for i in range(2):
-            for uid in current_order:
-                if i == 0:
-                    val = next(counter)
-                    indices[uid][1] = val
-                if i == 1:
-                    val = next(counter)
-                    indices[uid][2] = val
-        
-                e_start.append(val)
-
-        e_finish = []
-        for i in range(2):
-            for uid in new_order:
-                if i == 0:
-                    val = indices[uid][1]
-                else:
-                    val = indices[uid][2]
-                e_finish.append(val)
-
-
-        # Preparing state for reordering by reshaping
-        reshaped_dims = [dim for dim in dims] + [dim for dim in dims]
-        self.state = self.state.reshape(reshaped_dims)
-
-        self.state = np.einsum(self.state, e_start, e_finish)
-        new_prop_order = self.get_all_props(new_order)
-        self.state_props = new_prop_order
-        self.state = self.state.reshape(np.prod(dims), np.prod(dims))
+        new_order = [p.uuid for p in new_prop_order] + [
+            prop.uuid for prop in self.state_props if prop.uuid not in remove_set
+        ]
+        self.state_props = self.get_all_props(new_order)
 
     @Enforcer
     def apply_kraus_operators(self, operators:list,
@@ -166,12 +881,17 @@ class State:
 
         Notes
         -----
+        - A pure state stays pure when a single Kraus operator is applied; a channel with
+        more than one Kraus operator promotes the state to a density matrix.
         - The method reshapes the current state to a multi-dimensional array corresponding to
         the direct product space of the system's state properties.
-        - The indices for contraction are carefully assigned to match the Kraus operators and 
-        the state, ensuring proper application of the Kraus operators.
-        - The result is stored back in the `self.state` attribute after reshaping to the original 
-        matrix form.
+        - The axis bookkeeping is captured in a contraction plan, memoized per subsystem
+        dimensions and target positions (see `qsi.contraction`).
+        - The Kraus operators are stacked and applied in a single batched contraction, or
+        as a superoperator when that requires fewer operations.
+        - Only the factor holding `operation_spaces` is modified; if the spaces belong to
+        different factors, those factors are merged first. Afterwards, the spaces which
+        are left uncorrelated are split into their own factors again.
 
         Example
         -------
@@ -180,92 +900,17 @@ class State:
         operators to subsystem A, leaving subsystem B unchanged.
         """
         for p in operation_spaces:
-            assert p in self.state_props
-
-        state_order = [prop.uuid for prop in self.state_props]
-
-        # First we reshape the state matrix
-        dims = [p.truncation for p in self.state_props]
-        reshaped_dims = [dim for dim in dims] + [dim for dim in dims]
-        self.state = self.state.reshape(reshaped_dims)
-
-        # Get the order of the spaces in the product space
-        state_order = [prop.uuid for prop in self.state_props]
-        operator_order = [prop.uuid for prop in operation_spaces]
-
-        # We will keep track of the three sets of indices for each space
-        indices = {}
-        for uid in state_order:
-            indices[uid] = {
-                1: [],  # indices in first operator
-                2: [],  # indices in the state
-                3: []   # indices in the second operator
-            }
-
-        op_1_idcs = [] # First operator indices
-        state_idcs = [] # State indices
-        op_2_idcs = [] # Second operator indices
-        result_idcs = [] # Resulting indices
-
-        counter = itertools.count(start=0)
-
-        # Assigning first operator indices
-        for i in range(2):
-            for idc in operator_order:
-                val = next(counter)
-                op_1_idcs.append(val)
-                indices[idc][1].append(val)
-
-        # Assigning state indices
-        for i in range(2):
-            for idc in state_order:
-                if idc in operator_order and i == 0:
-                    val = indices[idc][1][1]
-                else:
-                    val = next(counter)
-                state_idcs.append(val)
-                indices[idc][2].append(val)
-
-        # Assigning second operator indices
-        for i in range(2):
-            for idc in operator_order:
-                if i == 0:
-                    val = next(counter)
-                else:
-                    val = indices[idc][2][1]
-                op_2_idcs.append(val)
-                indices[idc][3].append(val)
-
-        # Assigning resulting indices
-        for i in range(2):
-            for idc in state_order:
-                if idc in operator_order:
-                    if i == 0:
-                        val = indices[idc][1][0]
-                    elif i == 1:
-                        val = indices[idc][3][0]
-                else:
-                    val = indices[idc][2][i]
-                result_idcs.append(val)
-                        
-
-        #print(f"op_1_idcs: {op_1_idcs}")
-        #print(f"state_idcs: {state_idcs}")
-        #print(f"op_2_idcs: {op_2_idcs}")
-        #print(f"result_idcs:{result_idcs}")
-
-        new_state = np.zeros_like(self.state)
-        # Determine the shape of the kraus operators
-        kraus_shape = [prop.truncation for prop in operation_spaces]*2
-        for K in operators:
-            K = K.reshape(kraus_shape)
-            new_state += np.einsum(K, op_1_idcs,
-                      self.state, state_idcs,
-                      K.conj(), op_2_idcs,
-                      result_idcs)
-
-        dims = [p.truncation for p in self.state_props]
-        self.state = new_state.reshape([np.prod(dims)]*2)
+            assert p.uuid in self._index
+
+        # Operators which are exactly zero do not contribute to the channel
+        operators = [K for K in operators if np.any(K)]
+        factor = self._merge_factors(operation_spaces)
+        factor.apply(operators, operation_spaces)
+        self._split_factors(operation_spaces)
+        if self.truncation_threshold is not None:
+            self.adapt_truncation(operation_spaces)
+        if precision.CHECK_DRIFT:
+            precision.warn_drift(*self.drift())
 
     @Enforcer
     def get_reduced_state(self, spaces:list[StateProp]) -> np.ndarray:
@@ -292,55 +937,30 @@ class State:
         -----
         - The method reshapes the current state to a multi-dimensional array corresponding to
         the direct product space of the system's state properties.
-        - It uses the Einstein summation convention to perform the partial trace operation, 
-        effectively tracing out the subsystems not specified in `spaces`.
-        - The original state is not modified by this method.
+        - The partial trace is performed with a memoized contraction plan (see
+        `qsi.contraction`), effectively tracing out the subsystems not specified in `spaces`.
+        - The original state is not modified by this method. For a pure state the reduced
+        state is computed directly from the state vector.
+        - Factors are not merged, the reduced states of the individual factors are joined
+        with a tensor product instead.
 
         Example
         -------
         If `self.state_props` contains subsystems A, B, and C, and `spaces` specifies subsystem A and C,
         then the method will return the reduced density matrix of subsystems A and C, tracing out subsystem B.
         """
-        dims = [p.truncation for p in self.state_props]
-        out_dims = [p.truncation for p in spaces]
-        reshaped_dims = [dim for dim in dims] + [dim for dim in dims]
-        self.state = self.state.reshape(reshaped_dims)
-
-        counter = itertools.count(start=0)
-        state_order = [prop.uuid for prop in self.state_props]
-        
-        indices = {}
-        for uid in state_order:
-            indices[uid] = {
-                1: None,
-                2: None,
-            }
-
-        state_idcs = []
-        to_idcs = []
-        uid = [x.uuid for x in spaces]
-
-        for i in range(2):
-            for idc in state_order:
-                if i == 0:
-                    val = next(counter)
-                    if idc in uid:
-                        to_idcs.append(val)
-                    state_idcs.append(val)
-                    indices[idc][1]=val
-                else:
-                    if idc in uid:
-                        val = next(counter)
-                        to_idcs.append(val)
-                    else:
-                        val = indices[idc][1]
-                    state_idcs.append(val)
-                    indices[idc][2]=val
-        reduced_state = np.einsum(
-            self.state, state_idcs,
-            to_idcs
-        )
-
-        self.state = self.state.reshape([np.prod(dims)]*2)
-        return reduced_state.reshape([np.prod(out_dims)]*2)
-
+        # Kept spaces retain the order they have in the state
+        uid = set([x.uuid for x in spaces])
+        kept = [p for p in self.state_props if p.uuid in uid]
+        props = []
+        reduced_state = np.ones((1, 1), dtype=precision.get_dtype())
+        for f in self.factors:
+            factor_spaces = [p for p in f.props if p.uuid in uid]
+            if factor_spaces:
+                reduced_state = np.kron(reduced_state, f.reduce(factor_spaces))
+                props.extend(factor_spaces)
+            else:
+                reduced_state = reduced_state * f.trace()
+        reduced = Factor(props, matrix=reduced_state)
+        reduced.reorder(kept)
+        return reduced.matrix
@@ -0,0 +1,176 @@
+"""
+Streaming kernels for density matrices that do not fit in memory
+
+The density matrix is kept in a `np.memmap` backed file and processed block
+by block. When a channel acts on the target subsystems, the block of the
+density matrix belonging to a pair of basis states (r, r') of the remaining
+subsystems only depends on the same block of the input. The kernels
+therefore read a set of (r, r') blocks, transform them and write them back
+in place, so that the working memory is bounded by `MAX_BLOCK_ELEMENTS`.
+"""
+import os
+import tempfile
+import weakref
+
+import numpy as np
+
+from qsi.contraction import ContractionPlan, basis_permutation
+
+
+# Maximal number of matrix elements read into memory at once
+MAX_BLOCK_ELEMENTS = 2**22
+
+# Directory for the memory mapped files, None uses the system default
+MEMMAP_DIR = None
+
+
+def create_memmap(shape: tuple[int, int], dtype=complex) -> np.memmap:
+    """
+    Creates a zero initialized, memory mapped matrix backed by a temporary
+    file. The file is removed as soon as it is no longer mapped.
+    """
+    fd, path = tempfile.mkstemp(suffix=".qsi", dir=MEMMAP_DIR)
+    os.close(fd)
+    matrix = np.memmap(path, dtype=dtype, mode="w+", shape=shape)
+    try:
+        # The mapping keeps the data alive after the file is unlinked
+        os.unlink(path)
+    except OSError:
+        weakref.finalize(matrix, os.remove, path)
+    return matrix
+
+
+def is_memmap(matrix) -> bool:
+    return isinstance(matrix, np.memmap)
+
+
+def _rows_per_chunk(width: int) -> int:
+    return max(1, MAX_BLOCK_ELEMENTS // max(width, 1))
+
+
+def to_memmap(matrix) -> np.memmap:
+    """
+    Copies a matrix into a memory mapped matrix, row chunk by row chunk
+    """
+    out = create_memmap(matrix.shape, np.result_type(matrix.dtype, np.complex64))
+    step = _rows_per_chunk(matrix.shape[1])
+    for start in range(0, matrix.shape[0], step):
+        out[start:start + step] = matrix[start:start + step]
+    return out
+
+
+def outer(vector: np.ndarray) -> np.memmap:
+    """
+    Memory mapped density matrix of a state vector
+    """
+    out = create_memmap((len(vector), len(vector)), vector.dtype)
+    step = _rows_per_chunk(len(vector))
+    for start in range(0, len(vector), step):
+        out[start:start + step] = np.outer(vector[start:start + step], vector.conj())
+    return out
+
+
+def kron(a, b) -> np.memmap:
+    """
+    Memory mapped tensor product, written one row of `a` at a time
+    """
+    db = b.shape[0]
+    out = create_memmap((a.shape[0]*db, a.shape[1]*b.shape[1]),
+                        np.result_type(a.dtype, b.dtype))
+    for i in range(a.shape[0]):
+        out[i*db:(i + 1)*db] = np.kron(np.asarray(a[i:i + 1]), np.asarray(b))
+    return out
+
+
+def rest_chunks(plan: ContractionPlan, operators: int = 1) -> list[np.ndarray]:
+    """
+    Splits the basis states of the remaining subsystems into chunks, such
+    that a block of (chunk x chunk) fits into the working memory
+    """
+    width = int(np.sqrt(MAX_BLOCK_ELEMENTS/max(operators, 1)))
+    size = max(1, width // plan.d_target)
+    return [np.arange(start, min(start + size, plan.d_rest))
+            for start in range(0, plan.d_rest, size)]
+
+
+def block_indices(plan: ContractionPlan, chunk: np.ndarray) -> np.ndarray:
+    """
+    Flat indices of the basis states (t, r) for all targets t and the rest
+    states r in `chunk`, ordered target major
+    """
+    permuted = (np.arange(plan.d_target)[:, None]*plan.d_rest + chunk[None, :])
+    return basis_permutation(plan)[permuted.reshape(-1)]
+
+
+def apply_kraus_block(plan: ContractionPlan, operators: np.ndarray, rho,
+                      rows: np.ndarray, cols: np.ndarray):
+    """
+    Applies the Kraus operators to the (rows x cols) rest block in place
+    """
+    dt = plan.d_target
+    r_idx, c_idx = block_indices(plan, rows), block_indices(plan, cols)
+    block = np.asarray(rho[np.ix_(r_idx, c_idx)])
+    x = block.reshape(1, dt, len(rows)*dt*len(cols))
+    x = np.matmul(operators, x).reshape(-1, dt*len(rows), dt, len(cols))
+    x = np.matmul(operators.conj()[:, None], x).sum(axis=0)
+    rho[np.ix_(r_idx, c_idx)] = x.reshape(block.shape)
+
+
+def apply_kraus_streaming(plan: ContractionPlan, operators: np.ndarray, rho):
+    """
+    Computes sum_k K_k rho K_k^dagger in place, block by block
+    """
+    chunks = rest_chunks(plan, operators.shape[0] + 1)
+    for rows in chunks:
+        for cols in chunks:
+            apply_kraus_block(plan, operators, rho, rows, cols)
+    if isinstance(rho, np.memmap):
+        rho.flush()
+
+
+def reduce_block(plan: ContractionPlan, rho, chunk: np.ndarray) -> np.ndarray:
+    """
+    Contribution of the rest states in `chunk` to the reduced density matrix
+    """
+    dt = plan.d_target
+    idx = block_indices(plan, chunk)
+    block = np.asarray(rho[np.ix_(idx, idx)]).reshape(dt, len(chunk), dt, len(chunk))
+    return np.trace(block, axis1=1, axis2=3)
+
+
+def reduce_streaming(plan: ContractionPlan, rho) -> np.ndarray:
+    """
+    Reduced density matrix of the targeted subsystems, only the diagonal
+    blocks of the traced out subsystems are read
+    """
+    reduced = np.zeros((plan.d_target, plan.d_target), dtype=rho.dtype)
+    for chunk in rest_chunks(plan):
+        reduced += reduce_block(plan, rho, chunk)
+    return reduced
+
+
+def hermiticity_error(rho) -> float:
+    """
+    Frobenius norm of rho - rho^dagger, computed one row chunk at a time
+    """
+    error = 0.0
+    step = _rows_per_chunk(2*rho.shape[1])
+    for start in range(0, rho.shape[0], step):
+        rows = np.asarray(rho[start:start + step])
+        cols = np.asarray(rho[:, start:start + step])
+        error += np.linalg.norm(rows - cols.conj().T)**2
+    return float(np.sqrt(error))
+
+
+def reorder_streaming(plan: ContractionPlan, rho) -> np.memmap:
+    """
+    Reorders the density matrix into the order of the plan, the result is
+    written into a new memory mapped matrix one row chunk at a time
+    """
+    source = basis_permutation(plan)
+    out = create_memmap(rho.shape, rho.dtype)
+    step = _rows_per_chunk(rho.shape[1])
+    for start in range(0, rho.shape[0], step):
+        rows = np.asarray(rho[source[start:start + step]])
+        out[start:start + step] = rows[:, source]
+    return out
@@ -0,0 +1,224 @@
+"""
+Monte-Carlo quantum trajectories
+
+Instead of evolving the density matrix, a channel can be unravelled: on a
+state vector |psi>, the branch k of the channel is sampled with probability
+p_k = ||K_k psi||^2 and the vector is replaced by K_k psi/sqrt(p_k). The
+average over many trajectories converges to the density matrix evolution,
+while every trajectory only needs memory for a state vector (d^N instead of
+d^(2N)). Trajectories are independent, `run_trajectories` distributes them
+over a `ProcessPoolExecutor` and returns ensemble estimates with confidence
+intervals.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+import os
+from typing import Optional
+
+import numpy as np
+from scipy.stats import norm
+
+from qsi.state import State, StateProp
+from qsi.contraction import get_plan, apply_to_vector, reduce_vector
+from qsi.precision import get_dtype
+
+
+class TrajectoryState:
+    """
+    Single trajectory, a state vector over `state_props` which is evolved by
+    sampling one Kraus branch per channel application
+    """
+    def __init__(self, vector: np.ndarray, state_props: list[StateProp],
+                 rng: Optional[np.random.Generator] = None):
+        self.vector = vector
+        self.state_props = list(state_props)
+        self.rng = np.random.default_rng() if rng is None else rng
+
+    @property
+    def dims(self) -> tuple[int, ...]:
+        return tuple(p.truncation for p in self.state_props)
+
+    def _plan(self, spaces: list[StateProp]):
+        uuids = [p.uuid for p in self.state_props]
+        return get_plan(self.dims, tuple(uuids.index(p.uuid) for p in spaces))
+
+    def apply_kraus_operators(self, operators: list,
+                              operation_spaces: list[StateProp]) -> int:
+        """
+        Applies one Kraus operator of the set, sampled with the Born rule
+        probabilities, and returns the index of the sampled branch. For
+        channels which are not trace preserving the probabilities are
+        renormalized. A ValueError is raised if all branches vanish, the
+        channel annihilates the state of the trajectory.
+        """
+        for p in operation_spaces:
+            assert p in self.state_props
+        plan = self._plan(operation_spaces)
+        branches = [apply_to_vector(plan, np.asarray(K, dtype=self.vector.dtype),
+                                    self.vector) for K in operators]
+        weights = np.array([np.vdot(b, b).real for b in branches])
+        if not weights.sum() > 0:
+            raise ValueError("All Kraus branches have zero probability, the "
+                             "channel annihilates the state of the trajectory")
+        k = int(self.rng.choice(len(branches), p=weights/weights.sum()))
+        self.vector = branches[k]/np.sqrt(weights[k])
+        return k
+
+    def get_reduced_state(self, spaces: list[StateProp]) -> np.ndarray:
+        """
+        Reduced density matrix of the trajectory, the kept spaces retain the
+        order they have in the state
+        """
+        uid = set([x.uuid for x in spaces])
+        return reduce_vector(
+            self._plan([p for p in self.state_props if p.uuid in uid]), self.vector)
+
+    def expectation(self, operator: np.ndarray, spaces: list[StateProp]) -> complex:
+        """
+        Expectation value of an operator acting on `spaces` (in the given order)
+        """
+        rho = reduce_vector(self._plan(spaces), self.vector)
+        return np.trace(operator @ rho)
+
+
+@dataclass
+class TrajectoryResult:
+    """
+    Ensemble estimates of `run_trajectories`, errors are standard errors of
+    the mean (of the real and imaginary part) and intervals are normal
+    confidence intervals at the requested confidence level
+    """
+    n_trajectories: int
+    confidence: float
+    reduced_state: Optional[np.ndarray] = None
+    reduced_state_error: Optional[np.ndarray] = None
+    observables: dict[str, float] = field(default_factory=dict)
+    observable_errors: dict[str, float] = field(default_factory=dict)
+
+    def interval(self, name: str) -> tuple[float, float]:
+        z = norm.ppf(0.5 + self.confidence/2)
+        mean, error = self.observables[name], self.observable_errors[name]
+        return (mean - z*error, mean + z*error)
+
+
+def _initial_sampler(state: State):
+    """
+    Pure states start every trajectory in their state vector, mixed states
+    start in an eigenvector sampled with its eigenvalue. The factors of the
+    state are not merged.
+    """
+    vector = state._state_vector()
+    if vector is not None:
+        return (np.ones(1), vector[:, None])
+    w, v = np.linalg.eigh(state._density_matrix())
+    w = np.clip(w, 0, None)
+    keep = w > 0
+    return (w[keep]/w[keep].sum(), v[:, keep].astype(get_dtype()))
+
+
+def _run_chunk(starts, vectors, state_props, channels, reduced, observables,
+               seed):
+    """
+    Runs a chunk of trajectories, trajectory i starts in the column
+    `starts[i]` of `vectors`, and returns the sums and the sums of squares
+    of the estimated quantities
+    """
+    rng = np.random.default_rng(seed)
+    sums = {}
+
+    def accumulate(key, value):
+        value = np.asarray(value)
+        s, sr, si = sums.get(key, (0, 0, 0))
+        sums[key] = (s + value, sr + value.real**2, si + value.imag**2)
+
+    for start in starts:
+        trajectory = TrajectoryState(vectors[:, start].copy(), state_props, rng)
+        for operators, spaces in channels:
+            trajectory.apply_kraus_operators(operators, spaces)
+        if reduced is not None:
+            accumulate(None, trajectory.get_reduced_state(reduced))
+        for name, (operator, spaces) in observables.items():
+            accumulate(name, trajectory.expectation(operator, spaces).real)
+    return sums
+
+
+def _statistics(sums, n):
+    s, sr, si = sums
+    mean = s/n
+    var_re = np.clip(sr/n - mean.real**2, 0, None)*n/max(n - 1, 1)
+    var_im = np.clip(si/n - mean.imag**2, 0, None)*n/max(n - 1, 1)
+    error = np.sqrt(var_re/n)
+    if np.iscomplexobj(mean):
+        error = error + 1j*np.sqrt(var_im/n)
+    return mean, error
+
+
+def run_trajectories(state: State, channels: list, n_trajectories: int,
+                     reduced: Optional[list[StateProp]] = None,
+                     observables: Optional[dict] = None,
+                     workers: Optional[int] = None, seed=None,
+                     confidence: float = 0.95) -> TrajectoryResult:
+    """
+    Unravels a sequence of channels into quantum trajectories.
+
+    Parameters
+    ----------
+    state : State
+        Initial state, the input state is not modified. A mixed state is
+        diagonalized in the calling process, the initial eigenvectors are
+        sampled there and every worker only receives the eigenvectors its
+        trajectories start in.
+    channels : list
+        Sequence of (operators, operation_spaces) pairs, as they would be
+        passed to `State.apply_kraus_operators`.
+    n_trajectories : int
+        Number of sampled trajectories.
+    reduced : list[StateProp], optional
+        Spaces of which the averaged reduced density matrix is estimated.
+    observables : dict, optional
+        Maps names to (operator, spaces) pairs of Hermitian observables.
+    workers : int, optional
+        Number of worker processes, defaults to the number of cores. With
+        `workers=1` the trajectories run in the calling process.
+    seed : optional
+        Seed of the random number generators, the initial states and every
+        worker get independent streams spawned from it.
+    confidence : float
+        Confidence level of the intervals returned by `TrajectoryResult.interval`.
+    """
+    observables = {} if observables is None else observables
+    if workers is None:
+        workers = os.cpu_count() or 1
+    workers = max(1, min(workers, n_trajectories))
+    weights, vectors = _initial_sampler(state)
+    seeds = np.random.SeedSequence(seed).spawn(workers + 1)
+    starts = np.random.default_rng(seeds[-1]).choice(
+        len(weights), size=n_trajectories, p=weights)
+    chunks = []
+    for indices in np.array_split(starts, workers):
+        used, inverse = np.unique(indices, return_inverse=True)
+        chunks.append((inverse, vectors[:, used]))
+    args = (list(state.state_props), channels, reduced, observables)
+
+    if workers == 1:
+        results = [_run_chunk(*chunks[0], *args, seeds[0])]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(_run_chunk, *chunk, *args, s)
+                       for chunk, s in zip(chunks, seeds)]
+            results = [f.result() for f in futures]
+
+    totals = {}
+    for sums in results:
+        for key, value in sums.items():
+            totals[key] = tuple(a + b for a, b in zip(totals.get(key, (0, 0, 0)), value))
+
+    result = TrajectoryResult(n_trajectories, confidence)
+    if reduced is not None:
+        result.reduced_state, result.reduced_state_error = _statistics(
+            totals[None], n_trajectories)
+    for name in observables:
+        mean, error = _statistics(totals[name], n_trajectories)
+        result.observables[name] = float(mean)
+        result.observable_errors[name] = float(error)
+    return result
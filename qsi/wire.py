@@ -0,0 +1,196 @@
+"""
+Wire format of the messages
+
+Messages are sent as length prefixed frames (see `SocketHandler`). The
+payload of a frame is either the JSON encoded message, or a binary frame:
+
+    header   : magic b"QSIB", version (1 byte), 3 padding bytes and the
+               length of the metadata (4 bytes, big endian)
+    metadata : JSON encoded message, where every numpy array is replaced
+               by a reference {"__array__": i}, and the list of buffers
+               under "__buffers__" with dtype, shape and offset
+    buffers  : raw little-endian array data, every buffer starts at an
+               offset aligned to `ALIGNMENT` bytes
+
+A message containing numpy arrays is sent as a binary frame, any other
+message as JSON, so the receiver can always tell the formats apart. Binary
+frames are only sent to modules which declared the "binary" wire format
+in their `param_query_response`.
+
+Peers declaring the "shared" wire format (all modules are local processes)
+receive arrays of at least `SHARED_THRESHOLD` bytes in shared memory
+segments, the frame only holds the name of the segment. The lifetime of a
+segment follows these rules:
+
+    - the sender creates and fills the segment, once the frame is sent the
+      segment belongs to the receiver, the sender stops tracking it and
+      closes its mapping (`hand_over`); if sending fails it is unlinked
+      (`release`)
+    - the receiver attaches to the segment when decoding the frame, the
+      decoded array maps the segment without copying; the segment is
+      unlinked when the array is garbage collected, or by the resource
+      tracker of the receiver if it exits before
+"""
+import json
+import struct
+import weakref
+from multiprocessing import resource_tracker
+from multiprocessing import shared_memory
+
+import numpy as np
+
+
+MAGIC = b"QSIB"
+VERSION = 1
+HEADER = struct.Struct("!4sBxxxI")
+ALIGNMENT = 16
+
+# Wire formats understood by this implementation
+WIRE_FORMATS = ["json", "binary", "shared"]
+
+# Arrays of at least this many bytes are sent through shared memory
+SHARED_THRESHOLD = 2**20
+
+
+def contains_arrays(message) -> bool:
+    if isinstance(message, np.ndarray):
+        return True
+    if isinstance(message, dict):
+        return any(contains_arrays(v) for v in message.values())
+    if isinstance(message, (list, tuple)):
+        return any(contains_arrays(v) for v in message)
+    return False
+
+
+def _extract(message, arrays: list):
+    """
+    Replaces the arrays in a (nested) message by references
+    """
+    if isinstance(message, np.ndarray):
+        arrays.append(message)
+        return {"__array__": len(arrays) - 1}
+    if isinstance(message, dict):
+        return {k: _extract(v, arrays) for k, v in message.items()}
+    if isinstance(message, (list, tuple)):
+        return [_extract(v, arrays) for v in message]
+    return message
+
+
+def _insert(message, arrays: list):
+    """
+    Replaces the references in a decoded message by the arrays
+    """
+    if isinstance(message, dict):
+        if "__array__" in message and len(message) == 1:
+            return arrays[message["__array__"]]
+        return {k: _insert(v, arrays) for k, v in message.items()}
+    if isinstance(message, list):
+        return [_insert(v, arrays) for v in message]
+    return message
+
+
+def _aligned(n: int) -> int:
+    return -(-n // ALIGNMENT)*ALIGNMENT
+
+
+def _to_segment(array: np.ndarray) -> shared_memory.SharedMemory:
+    shm = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+    return shm
+
+
+def _release(shm: shared_memory.SharedMemory):
+    try:
+        shm.unlink()
+    except FileNotFoundError:
+        pass
+    try:
+        shm.close()
+    except BufferError:
+        # Still exported by a view of the array, the mapping is closed
+        # when the last view is collected
+        pass
+
+
+def release(segments: list[shared_memory.SharedMemory]):
+    """
+    Unlinks the segments of a frame which could not be sent
+    """
+    for shm in segments:
+        _release(shm)
+
+
+def hand_over(segments: list[shared_memory.SharedMemory]):
+    """
+    Passes the ownership of the segments of a sent frame to the receiver
+    """
+    for shm in segments:
+        resource_tracker.unregister(shm._name, "shared_memory")
+        shm.close()
+
+
+def _attach(name: str, shape: list, dtype: np.dtype) -> np.ndarray:
+    shm = shared_memory.SharedMemory(name=name)
+    array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+    weakref.finalize(array, _release, shm)
+    return array
+
+
+def encode(message: dict, segments: list = None) -> tuple[bytes, dict]:
+    """
+    Encodes a message, returns the payload and the JSON part of the message
+    (with array references), against which the message schema is validated.
+    If a list of `segments` is given, large arrays are placed in shared
+    memory segments which are appended to it (see `hand_over`).
+    """
+    if not contains_arrays(message):
+        return json.dumps(message).encode("utf-8"), message
+    arrays = []
+    metadata = _extract(message, arrays)
+    buffers, layout, offset = [], [], 0
+    for array in arrays:
+        array = np.ascontiguousarray(array, dtype=array.dtype.newbyteorder("<"))
+        if segments is not None and array.nbytes >= SHARED_THRESHOLD:
+            segments.append(_to_segment(array))
+            layout.append({"dtype": array.dtype.str, "shape": list(array.shape),
+                           "shm": segments[-1].name})
+            continue
+        layout.append({"dtype": array.dtype.str, "shape": list(array.shape),
+                       "offset": offset})
+        data = array.tobytes()
+        buffers.append(data + b"\0"*(_aligned(len(data)) - len(data)))
+        offset += _aligned(len(data))
+    frame = dict(metadata, __buffers__=layout)
+    meta = json.dumps(frame).encode("utf-8")
+    meta += b" "*(_aligned(HEADER.size + len(meta)) - HEADER.size - len(meta))
+    payload = b"".join([HEADER.pack(MAGIC, VERSION, len(meta)), meta] + buffers)
+    return payload, metadata
+
+
+def is_binary(payload) -> bool:
+    return bytes(payload[:len(MAGIC)]) == MAGIC
+
+
+def decode(payload) -> dict:
+    """
+    Decodes the payload of a frame, the arrays of a binary frame are views
+    of the payload or of the shared memory segments
+    """
+    if not is_binary(payload):
+        return json.loads(bytes(payload).decode("utf-8"))
+    magic, version, length = HEADER.unpack_from(payload)
+    if version != VERSION:
+        raise ValueError(f"Unsupported binary frame version {version}")
+    start = HEADER.size + length
+    frame = json.loads(bytes(payload[HEADER.size:start]).decode("utf-8"))
+    arrays = []
+    for buffer in frame.pop("__buffers__"):
+        dtype = np.dtype(buffer["dtype"])
+        if "shm" in buffer:
+            arrays.append(_attach(buffer["shm"], buffer["shape"], dtype))
+            continue
+        count = int(np.prod(buffer["shape"]))
+        array = np.frombuffer(payload, dtype=dtype, count=count,
+                              offset=start + buffer["offset"])
+        arrays.append(array.reshape(buffer["shape"]))
+    return _insert(frame, arrays)
@@ -0,0 +1,97 @@
+import unittest
+
+import numpy as np
+
+from qsi.state import State, StateProp
+from qsi.batch import BatchState
+from qsi.contraction import get_plan, apply_kraus_to_batch, apply_kraus_to_density
+
+
+def loss(eta):
+    """
+    Photon loss on a mode truncated at two photons
+    """
+    return [np.diag([1, np.sqrt(eta), eta]),
+            np.diag([np.sqrt(1 - eta), np.sqrt(2*eta*(1 - eta))], 1),
+            np.diag([1 - eta], 2)]
+
+
+class TestBatchState(unittest.TestCase):
+    def setUp(self):
+        self.pA = StateProp(state_type="light", truncation=3, wavelength=1550,
+                            polarization="H", bandwidth=1, uuid="A")
+        self.pB = StateProp(state_type="internal", truncation=2, uuid="B")
+        self.etas = np.linspace(0.1, 0.9, 5)
+        self.creation = np.diag(np.sqrt([1, 2]), -1)
+        self.hadamard = np.array([[1, 1], [1, -1]])/np.sqrt(2)
+        self.swap = np.zeros((6, 6))
+        for n in range(3):
+            for m in range(2):
+                self.swap[3*m + n, 2*n + m] = 1
+
+    def test_batched_kernel_matches_loop(self):
+        rng = np.random.default_rng(0)
+        rho = rng.normal(size=(4, 24, 24)) + 1j*rng.normal(size=(4, 24, 24))
+        ops = rng.normal(size=(4, 3, 6, 6)) + 1j*rng.normal(size=(4, 3, 6, 6))
+        plan = get_plan((2, 3, 4), (1, 0))
+        expected = np.stack([apply_kraus_to_density(plan, K, r) for K, r in zip(ops, rho)])
+        np.testing.assert_array_almost_equal(expected, apply_kraus_to_batch(plan, ops, rho))
+        expected = np.stack([apply_kraus_to_density(plan, ops[0], r) for r in rho])
+        np.testing.assert_array_almost_equal(expected, apply_kraus_to_batch(plan, ops[0], rho))
+
+    def test_sweep_matches_individual_states(self):
+        batch = BatchState(self.pA, batch_size=len(self.etas))
+        batch.join(BatchState(self.pB))
+        batch.apply_kraus_operators([self.creation], [self.pA])
+        batch.apply_kraus_operators([self.hadamard], [self.pB])
+        self.assertTrue(batch.is_pure)
+        per_member = [np.stack([loss(eta)[k] for eta in self.etas]) for k in range(3)]
+        batch.apply_kraus_operators(per_member, [self.pA])
+        self.assertFalse(batch.is_pure)
+        batch.apply_kraus_operators([self.swap], [self.pA, self.pB])
+        for i, eta in enumerate(self.etas):
+            state = State(self.pA)
+            state.join(State(self.pB))
+            state.apply_kraus_operators([self.creation], [self.pA])
+            state.apply_kraus_operators([self.hadamard], [self.pB])
+            state.apply_kraus_operators(loss(eta), [self.pA])
+            state.apply_kraus_operators([self.swap], [self.pA, self.pB])
+            np.testing.assert_array_almost_equal(batch.state[i], state.state)
+            np.testing.assert_array_almost_equal(
+                batch.get_reduced_state([self.pA])[i], state.get_reduced_state([self.pA]))
+            np.testing.assert_array_almost_equal(batch[i].state, state.state)
+
+    def test_pure_per_member_operators(self):
+        phases = np.stack([np.diag([1, np.exp(1j*phi)]) for phi in self.etas])
+        batch = BatchState(self.pB)
+        batch.apply_kraus_operators([self.hadamard], [self.pB])
+        batch.apply_kraus_operators([phases], [self.pB])
+        self.assertEqual(batch.batch_size, len(self.etas))
+        self.assertTrue(batch.is_pure)
+        coherences = batch.get_reduced_state([self.pB])[:, 0, 1]
+        np.testing.assert_array_almost_equal(coherences, np.exp(-1j*self.etas)/2)
+
+    def test_from_states_and_reorder(self):
+        states = []
+        for eta in self.etas[:2]:
+            state = State(self.pA)
+            state.join(State(self.pB))
+            state.apply_kraus_operators([self.creation], [self.pA])
+            state.apply_kraus_operators(loss(eta), [self.pA])
+            states.append(state)
+        batch = BatchState.from_states(states)
+        batch._reorder([self.pB, self.pA])
+        for state, rho in zip(states, batch.state):
+            state._reorder([self.pB, self.pA])
+            np.testing.assert_array_almost_equal(rho, state.state)
+
+    def test_mismatched_batch(self):
+        with self.assertRaises(ValueError):
+            BatchState(self.pA, batch_size=2).join(BatchState(self.pB, batch_size=3))
+        batch = BatchState(self.pB, batch_size=2)
+        with self.assertRaises(ValueError):
+            batch.apply_kraus_operators([np.stack([np.eye(2)]*3)], [self.pB])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,128 @@
+import tracemalloc
+import unittest
+import numpy as np
+
+from qsi.contraction import (
+    get_plan, clear_plan_cache, apply_to_density, reduce_density,
+    apply_kraus_to_density, apply_superoperator, superoperator
+)
+from qsi import contraction
+from qsi import parallel
+
+
+class TestContractionPlan(unittest.TestCase):
+
+    def test_plan_is_memoized(self):
+        clear_plan_cache()
+        plan = get_plan((2, 3, 4), (2, 0))
+        self.assertIs(plan, get_plan((2, 3, 4), (2, 0)))
+        self.assertEqual(get_plan.cache_info().hits, 1)
+        self.assertEqual(plan.perm, (2, 0, 1))
+        self.assertEqual((plan.d_target, plan.d_rest), (8, 3))
+
+    def test_apply_matches_einsum(self):
+        rng = np.random.default_rng(1)
+        rho = rng.normal(size=(24, 24)) + 1j*rng.normal(size=(24, 24))
+        K = rng.normal(size=(8, 8)) + 1j*rng.normal(size=(8, 8))
+        plan = get_plan((2, 3, 4), (2, 0))
+        expected = np.einsum(
+            K.reshape(4, 2, 4, 2), [0, 1, 2, 3],
+            rho.reshape(2, 3, 4, 2, 3, 4), [3, 4, 2, 5, 6, 7],
+            K.conj().reshape(4, 2, 4, 2), [8, 9, 7, 5],
+            [1, 4, 0, 9, 6, 8]
+        ).reshape(24, 24)
+        np.testing.assert_array_almost_equal(
+            expected, apply_to_density(plan, K, rho))
+
+    def test_reduce_matches_einsum(self):
+        rng = np.random.default_rng(2)
+        rho = rng.normal(size=(24, 24)) + 1j*rng.normal(size=(24, 24))
+        expected = np.einsum(
+            rho.reshape(2, 3, 4, 2, 3, 4), [0, 1, 2, 3, 1, 4], [0, 2, 3, 4]
+        ).reshape(8, 8)
+        np.testing.assert_array_almost_equal(
+            expected, reduce_density(get_plan((2, 3, 4), (0, 2)), rho))
+
+    def test_kraus_set_paths_agree(self):
+        rng = np.random.default_rng(3)
+        rho = rng.normal(size=(24, 24)) + 1j*rng.normal(size=(24, 24))
+        ops = rng.normal(size=(7, 6, 6)) + 1j*rng.normal(size=(7, 6, 6))
+        plan = get_plan((2, 3, 4), (1, 0))
+        expected = sum(apply_to_density(plan, K, rho) for K in ops)
+        np.testing.assert_array_almost_equal(
+            expected, apply_superoperator(plan, superoperator(ops), rho))
+        np.testing.assert_array_almost_equal(
+            expected, apply_kraus_to_density(plan, ops[:1], rho) +
+            apply_kraus_to_density(plan, ops[1:], rho))
+        self.assertFalse(plan.prefers_superoperator(1))
+
+    def test_kraus_set_in_chunks(self):
+        rng = np.random.default_rng(4)
+        rho = rng.normal(size=(24, 24)) + 1j*rng.normal(size=(24, 24))
+        ops = rng.normal(size=(7, 12, 12)) + 1j*rng.normal(size=(7, 12, 12))
+        plan = get_plan((2, 3, 4), (2, 1))
+        self.assertFalse(plan.prefers_superoperator(7))
+        expected = sum(apply_to_density(plan, K, rho) for K in ops)
+        limit = contraction.MAX_BATCH_ELEMENTS
+        contraction.MAX_BATCH_ELEMENTS = 3*rho.size
+        try:
+            np.testing.assert_array_almost_equal(
+                expected, apply_kraus_to_density(plan, ops, rho))
+        finally:
+            contraction.MAX_BATCH_ELEMENTS = limit
+
+
+class TestParallelKraus(unittest.TestCase):
+    def setUp(self):
+        parallel.set_threads(3, min_elements=1)
+        rng = np.random.default_rng(4)
+        self.rho = rng.normal(size=(24, 24)) + 1j*rng.normal(size=(24, 24))
+        self.ops = rng.normal(size=(5, 6, 6)) + 1j*rng.normal(size=(5, 6, 6))
+
+    def tearDown(self):
+        parallel.set_threads(1, min_elements=2**16)
+
+    def check(self, dims, targets, ops):
+        plan = get_plan(dims, targets)
+        expected = sum(apply_to_density(plan, K, self.rho) for K in ops)
+        np.testing.assert_array_almost_equal(
+            expected, parallel.apply_kraus_parallel(plan, ops, self.rho))
+
+    def test_row_blocks(self):
+        self.check((2, 3, 4), (1, 0), self.ops[:2])
+
+    def test_kraus_set_partition(self):
+        rng = np.random.default_rng(5)
+        ops = rng.normal(size=(5, 12, 12)) + 1j*rng.normal(size=(5, 12, 12))
+        self.check((12, 2), (0,), ops)
+
+    def test_superoperator_columns(self):
+        self.check((2, 3, 4), (1, 0), self.ops[:1].repeat(40, axis=0))
+
+    def test_memory_bound(self):
+        rng = np.random.default_rng(6)
+        rho = rng.normal(size=(512, 512)) + 0j
+        ops = rng.normal(size=(7, 16, 16)) + 0j
+        plan = get_plan((16, 32), (0,))
+        self.assertFalse(plan.prefers_superoperator(7))
+        parallel.set_threads(4, min_elements=1)
+        limit = contraction.MAX_BATCH_ELEMENTS
+        contraction.MAX_BATCH_ELEMENTS = rho.size
+        tracemalloc.start()
+        try:
+            out = parallel.apply_kraus_parallel(plan, ops, rho)
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+            contraction.MAX_BATCH_ELEMENTS = limit
+        # Input reordering, output, one operator slice and the accumulators
+        self.assertLess(peak, 5*rho.nbytes)
+        np.testing.assert_array_almost_equal(out, apply_kraus_to_density(plan, ops, rho))
+
+    def test_invalid_threads(self):
+        with self.assertRaises(ValueError):
+            parallel.set_threads(0)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,35 @@
+import json
+import unittest
+
+import numpy as np
+
+from qsi.helpers import numpy_to_json, json_to_numpy, kraus_to_json, json_to_kraus
+
+
+class TestJsonConversion(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        self.matrix = rng.normal(size=(3, 4)) + 1j*rng.normal(size=(3, 4))
+
+    def test_element_format(self):
+        data = numpy_to_json(self.matrix)
+        self.assertEqual(data[1][2], [self.matrix[1, 2].real, self.matrix[1, 2].imag])
+        self.assertEqual(numpy_to_json(np.eye(2))[0], [[1.0, 0.0], [0.0, 0.0]])
+
+    def test_round_trip(self):
+        data = json.loads(json.dumps(numpy_to_json(self.matrix)))
+        np.testing.assert_array_equal(json_to_numpy(data), self.matrix)
+        tensor = self.matrix.reshape(2, 3, 2)
+        np.testing.assert_array_equal(json_to_numpy(numpy_to_json(tensor)), tensor)
+
+    def test_kraus_list(self):
+        ops = [self.matrix[:3, :3], 2*self.matrix[:3, :3]]
+        data = kraus_to_json(ops)
+        self.assertEqual(data, [numpy_to_json(K) for K in ops])
+        for K, L in zip(ops, json_to_kraus(data)):
+            np.testing.assert_array_equal(K, L)
+        self.assertEqual(json_to_kraus(kraus_to_json([])), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
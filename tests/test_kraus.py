@@ -0,0 +1,38 @@
+import unittest
+
+import numpy as np
+
+from qsi.kraus import choi_matrix, compress_kraus
+
+
+class TestKrausCompression(unittest.TestCase):
+    def setUp(self):
+        eta = 0.7
+        self.loss = [np.diag([1, np.sqrt(eta), eta]),
+                     np.diag([np.sqrt(1 - eta), np.sqrt(2*eta*(1 - eta))], 1),
+                     np.diag([1 - eta], 2)]
+
+    def test_redundant_operators_are_removed(self):
+        ops = self.loss + [np.zeros((3, 3))]
+        # Splitting an operator into two copies does not change the channel
+        ops = ops[:2] + [ops[2]/np.sqrt(2), ops[2]/np.sqrt(2), ops[3]]
+        compressed = compress_kraus(ops)
+        self.assertEqual(len(compressed), 3)
+        np.testing.assert_array_almost_equal(choi_matrix(compressed), choi_matrix(ops))
+
+    def test_choi_path(self):
+        # More operators than matrix elements
+        rng = np.random.default_rng(0)
+        ops = list(rng.normal(size=(6, 2, 2)) + 1j*rng.normal(size=(6, 2, 2)))
+        compressed = compress_kraus(ops)
+        self.assertLessEqual(len(compressed), 4)
+        np.testing.assert_array_almost_equal(choi_matrix(compressed), choi_matrix(ops))
+
+    def test_minimal_set_is_unchanged(self):
+        compressed = compress_kraus(self.loss)
+        self.assertTrue(all(a is b for a, b in zip(compressed, self.loss)))
+        self.assertEqual(compress_kraus([np.zeros((2, 2))]), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+
+import numpy as np
+from scipy.linalg import sqrtm
+
+from qsi import metrics
+
+
+def random_density(d, rank, seed):
+    rng = np.random.default_rng(seed)
+    A = rng.normal(size=(d, rank)) + 1j*rng.normal(size=(d, rank))
+    rho = A @ A.conj().T
+    return rho/np.trace(rho)
+
+
+def sqrtm_fidelity(rho, sigma):
+    root = sqrtm(rho)
+    return np.abs(np.trace(sqrtm(root @ sigma @ root)))**2
+
+
+class TestMetrics(unittest.TestCase):
+    def test_fidelity_matches_sqrtm(self):
+        rho, sigma = random_density(5, 3, 0), random_density(5, 4, 1)
+        self.assertAlmostEqual(metrics.fidelity(rho, sigma), sqrtm_fidelity(rho, sigma))
+        self.assertAlmostEqual(metrics.fidelity(rho, rho), 1)
+        # The decomposition of the reference is reused
+        hits = metrics._sqrt_reference.cache_info().hits
+        metrics.fidelity(rho, random_density(5, 2, 2))
+        self.assertEqual(metrics._sqrt_reference.cache_info().hits, hits + 1)
+
+    def test_pure_and_diagonal_shortcuts(self):
+        psi = random_density(4, 1, 3)
+        sigma = random_density(4, 4, 4)
+        self.assertAlmostEqual(metrics.fidelity(psi, sigma), sqrtm_fidelity(sigma, psi))
+        self.assertAlmostEqual(metrics.fidelity(sigma, psi), np.trace(psi @ sigma).real)
+        p, q = np.diag([0.5, 0.3, 0.2]), np.diag([0.2, 0.2, 0.6])
+        self.assertAlmostEqual(metrics.fidelity(p, q), sqrtm_fidelity(p, q))
+        self.assertAlmostEqual(metrics.trace_distance(p, q), 0.4)
+
+    def test_trace_distance_and_purity(self):
+        rho, sigma = random_density(4, 2, 5), random_density(4, 3, 6)
+        expected = 0.5*np.sum(np.abs(np.linalg.eigvals(rho - sigma)))
+        self.assertAlmostEqual(metrics.trace_distance(rho, sigma), expected)
+        psi, phi = random_density(4, 1, 7), random_density(4, 1, 8)
+        expected = 0.5*np.sum(np.abs(np.linalg.eigvals(psi - phi)))
+        self.assertAlmostEqual(metrics.trace_distance(psi, phi), expected)
+        self.assertAlmostEqual(metrics.purity(psi), 1)
+        self.assertAlmostEqual(metrics.purity(np.eye(4)/4), 0.25)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,121 @@
+import unittest
+
+import numpy as np
+
+from qsi.state import State, StateProp
+from qsi.mps import MPDOState
+
+
+def beam_splitter(d):
+    """
+    Unitary exp(-i pi/4 (a^dagger b + a b^dagger)) on two truncated modes
+    """
+    a = np.diag(np.sqrt(np.arange(1, d)), 1)
+    H = np.kron(a.conj().T, a) + np.kron(a, a.conj().T)
+    w, v = np.linalg.eigh(H)
+    return v @ np.diag(np.exp(-1j*np.pi/4*w)) @ v.conj().T
+
+
+class TestMPDOState(unittest.TestCase):
+    def setUp(self):
+        self.d = 3
+        self.props = [
+            StateProp(state_type="light", truncation=self.d, wavelength=1550,
+                      polarization="H", bandwidth=1, uuid=str(i))
+            for i in range(5)
+        ]
+        self.creation = np.diag(np.sqrt(np.arange(1, self.d)), -1)
+        # Photon loss with transmissivity 0.8
+        self.loss = [np.diag([1, np.sqrt(0.8), 0.8]),
+                     np.diag([np.sqrt(0.2), np.sqrt(0.32)], 1),
+                     np.diag([0.2], 2)]
+
+    def build(self):
+        mpdo = MPDOState(self.props[0])
+        dense = State(self.props[0])
+        for p in self.props[1:]:
+            mpdo.join(MPDOState(p))
+            dense.join(State(p))
+        return mpdo, dense
+
+    def evolve(self, state):
+        state.apply_kraus_operators([self.creation], [self.props[0]])
+        state.apply_kraus_operators([self.creation], [self.props[2]])
+        for i in range(4):
+            state.apply_kraus_operators(
+                [beam_splitter(self.d)], [self.props[i], self.props[i + 1]])
+            state.apply_kraus_operators(self.loss, [self.props[i]])
+
+    def test_matches_dense_state(self):
+        mpdo, dense = self.build()
+        self.evolve(mpdo)
+        self.evolve(dense)
+        self.assertTrue(np.allclose(mpdo.state, dense.state))
+        for spaces in ([self.props[1]], [self.props[3], self.props[0]],
+                       [self.props[4], self.props[2]]):
+            self.assertTrue(np.allclose(
+                mpdo.get_reduced_state(spaces), dense.get_reduced_state(spaces)))
+        self.assertAlmostEqual(mpdo.trace().real, 1)
+        self.assertAlmostEqual(mpdo.truncation_error, 0)
+
+    def test_distant_sites(self):
+        mpdo, dense = self.build()
+        for state in (mpdo, dense):
+            state.apply_kraus_operators([self.creation], [self.props[1]])
+            state.apply_kraus_operators(
+                [beam_splitter(self.d)], [self.props[4], self.props[1]])
+        self.assertTrue(np.allclose(mpdo.state, dense.state))
+
+    def test_bond_truncation(self):
+        mpdo, _ = self.build()
+        mpdo.max_bond = 2
+        self.evolve(mpdo)
+        self.assertTrue(all(chi <= 2 for chi in mpdo.bond_dimensions))
+        self.assertGreater(mpdo.truncation_error, 0)
+
+    def test_from_state(self):
+        _, dense = self.build()
+        self.evolve(dense)
+        mpdo = MPDOState.from_state(dense)
+        self.assertTrue(np.allclose(mpdo.state, dense.state))
+        self.assertTrue(np.allclose(mpdo.to_state().state, dense.state))
+
+    def test_logical_reorder(self):
+        mpdo, dense = self.build()
+        self.evolve(mpdo)
+        self.evolve(dense)
+        order = [self.props[3], self.props[1]]
+        mpdo._reorder(order)
+        dense._reorder(order)
+        self.assertTrue(np.allclose(mpdo.state, dense.state))
+        self.assertEqual(mpdo.get_index("3"), 0)
+
+    def test_discard(self):
+        mpdo, dense = self.build()
+        self.evolve(mpdo)
+        self.evolve(dense)
+        for state in (mpdo, dense):
+            state.discard([self.props[0], self.props[2], self.props[4]])
+            state.collect()
+        self.assertEqual([p.uuid for p in mpdo.state_props], ["1", "3"])
+        self.assertEqual(mpdo.dimensions, self.d**2)
+        self.assertTrue(np.allclose(mpdo.state, dense.state))
+
+    def test_to_message(self):
+        mpdo, dense = self.build()
+        self.evolve(mpdo)
+        self.evolve(dense)
+        ports = {"input": ["3", "1"]}
+        for state_input in ("full", "reduced", "props"):
+            message = mpdo.to_message(ports, state_input=state_input)
+            expected = dense.to_message(ports, state_input=state_input)
+            self.assertEqual(message["state_props"], expected["state_props"])
+            self.assertEqual(message["dimensions"], expected["dimensions"])
+            self.assertEqual("state" in message, "state" in expected)
+            if "state" in message:
+                self.assertTrue(np.allclose(State.from_message(message).state,
+                                            State.from_message(expected).state))
+
+
+if __name__ == "__main__":
+    unittest.main()
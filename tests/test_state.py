@@ -1,7 +1,15 @@
 import unittest
+from unittest import mock
 import numpy as np
 
-from qsi.state import State, StateProp
+from qsi.state import State, StateProp, Factor, _is_product
+from qsi.contraction import get_plan, reduce_density
+from qsi.blocks import PhotonBlocks
+from qsi import streaming
+from qsi import shared
+from qsi import sparse as sparse_ops
+from qsi import precision
+from qsi.helpers import numpy_to_json, json_to_numpy
 
 class TestStateReorder(unittest.TestCase):
     def setUp(self):
@@ -101,5 +109,619 @@ class TestStateReduction(unittest.TestCase):
         print(A.state)
 
 
+class TestPureState(unittest.TestCase):
+    def setUp(self):
+        self.pA = StateProp(state_type="light", truncation=2, wavelength=700,
+                            polarization="R", bandwidth=1)
+        self.pB = StateProp(state_type="internal", truncation=3)
+
+    def test_state_starts_pure(self):
+        A = State(self.pA)
+        self.assertTrue(A.is_pure)
+        A.join(State(self.pB))
+        self.assertTrue(A.is_pure)
+        self.assertEqual(A.vector.shape, (6,))
+
+    def test_unitary_keeps_state_pure(self):
+        A = State(self.pA)
+        A.join(State(self.pB))
+        X = np.array([[0, 1], [1, 0]])
+        A.apply_kraus_operators([X], [self.pA])
+        self.assertTrue(A.is_pure)
+        expected_state = np.kron(
+            np.array([[0, 0], [0, 1]]),
+            np.array([[1, 0, 0], [0, 0, 0], [0, 0, 0]]),
+        )
+        np.testing.assert_array_almost_equal(expected_state, A.state)
+
+    def test_multiple_kraus_operators_promote(self):
+        A = State(self.pA)
+        A.join(State(self.pB))
+        H = np.array([[1, 1], [1, -1]])/np.sqrt(2)
+        A.apply_kraus_operators([H], [self.pA])
+        dephase = [np.diag([1, 0]), np.diag([0, 1])]
+        A.apply_kraus_operators(dephase, [self.pA])
+        self.assertFalse(A.is_pure)
+        np.testing.assert_array_almost_equal(
+            A.get_reduced_state([self.pA]), np.eye(2)/2)
+
+    def test_pure_matches_mixed(self):
+        A = State(self.pA)
+        A.join(State(self.pB))
+        M = State(self.pA)
+        M.join(State(self.pB))
+        M.state  # promote to a density matrix
+        U = np.kron(np.array([[1, 1], [1, -1]])/np.sqrt(2),
+                    np.array([[0, 0, 1], [1, 0, 0], [0, 1, 0]]))
+        for s in (A, M):
+            s.apply_kraus_operators([U], [self.pA, self.pB])
+            s._reorder([self.pB, self.pA])
+        np.testing.assert_array_almost_equal(
+            A.get_reduced_state([self.pB]), M.get_reduced_state([self.pB]))
+        np.testing.assert_array_almost_equal(A.state, M.state)
+
+
+class TestFactorizedState(unittest.TestCase):
+    def setUp(self):
+        self.props = [
+            StateProp(state_type="light", truncation=2, wavelength=1550,
+                      polarization="H", bandwidth=1),
+            StateProp(state_type="internal", truncation=3),
+            StateProp(state_type="light", truncation=2, wavelength=1550,
+                      polarization="V", bandwidth=1),
+        ]
+        self.state = State(self.props[0])
+        for p in self.props[1:]:
+            self.state.join(State(p))
+
+    def test_join_keeps_factors(self):
+        self.assertEqual(len(self.state.factors), 3)
+        self.assertEqual(self.state.dimensions, 12)
+
+    def test_channel_merges_touched_factors(self):
+        pA, pB, pC = self.props
+        CNOT = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]])
+        H = np.array([[1, 1], [1, -1]])/np.sqrt(2)
+        self.state.apply_kraus_operators([H], [pA])
+        self.assertEqual(len(self.state.factors), 3)
+        self.state.apply_kraus_operators([CNOT], [pA, pC])
+        self.assertEqual(len(self.state.factors), 2)
+        bell = np.array([[1, 0, 0, 1], [0, 0, 0, 0], [0, 0, 0, 0], [1, 0, 0, 1]])/2
+        np.testing.assert_array_almost_equal(
+            self.state.get_reduced_state([pA, pC]), bell)
+        np.testing.assert_array_almost_equal(
+            self.state.get_reduced_state([pB]), np.diag([1, 0, 0]))
+
+    def test_reduced_state_across_factors(self):
+        pA, pB, pC = self.props
+        X = np.array([[0, 1], [1, 0]])
+        self.state.apply_kraus_operators([X], [pC])
+        self.state.apply_kraus_operators([np.diag([1, 0]), np.diag([0, 1])], [pA])
+        reduced = self.state.get_reduced_state([pC, pA])
+        np.testing.assert_array_almost_equal(reduced, np.diag([0, 1, 0, 0]))
+        self.assertEqual(len(self.state.factors), 3)
+        np.testing.assert_array_almost_equal(
+            self.state.state, np.kron(np.kron(np.diag([1, 0]), np.diag([1, 0, 0])),
+                                      np.diag([0, 1])))
+        self.assertEqual(len(self.state.factors), 1)
+
+    def test_uncorrelated_spaces_are_split(self):
+        pA, pB, pC = self.props
+        CNOT = np.array([[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 0, 1], [0, 0, 1, 0]])
+        self.state.apply_kraus_operators([CNOT], [pA, pC])
+        self.assertEqual(len(self.state.factors), 3)
+
+        # Entangle and then reset the first mode
+        H = np.array([[1, 1], [1, -1]])/np.sqrt(2)
+        self.state.apply_kraus_operators([H], [pA])
+        self.state.apply_kraus_operators([CNOT], [pA, pC])
+        self.assertEqual(len(self.state.factors), 2)
+        reset = [np.array([[1, 0], [0, 0]]), np.array([[0, 1], [0, 0]])]
+        self.state.apply_kraus_operators(reset, [pA])
+        self.assertEqual(len(self.state.factors), 3)
+        np.testing.assert_array_almost_equal(
+            self.state.get_reduced_state([pC]), np.eye(2)/2)
+        np.testing.assert_array_almost_equal(
+            self.state.get_reduced_state([pA]), np.diag([1, 0]))
+
+    def test_factorize(self):
+        pA, pB, pC = self.props
+        self.state.split_tolerance = None
+        self.state.apply_kraus_operators([np.eye(12)], [pA, pB, pC])
+        self.assertEqual(len(self.state.factors), 1)
+        self.state.split_tolerance = 1e-10
+        self.state.factorize()
+        self.assertEqual(len(self.state.factors), 3)
+
+    def test_correlated_factor_is_not_reduced(self):
+        pA, pB, pC = self.props
+        rng = np.random.default_rng(9)
+        ops = rng.normal(size=(2, 12, 12)) + 1j*rng.normal(size=(2, 12, 12))
+        self.state.apply_kraus_operators(list(ops), [pA, pB, pC])
+        factor = self.state.factors[0]
+        with mock.patch.object(Factor, "_reduce", side_effect=AssertionError):
+            for p in self.props:
+                self.assertIsNone(factor.split(p, 1e-10))
+
+    def test_product_check_in_blocks(self):
+        rng = np.random.default_rng(8)
+        rho_a = np.diag([0.25, 0.5, 0.25]).astype(complex)
+        rho_b = rng.normal(size=(4, 4)) + 1j*rng.normal(size=(4, 4))
+        rho_b = rho_b @ rho_b.conj().T
+        # Middle subsystem in a product with the outer ones, and a perturbation
+        rho = np.einsum("ikjl,mn->imkjnl", rho_b.reshape(2, 2, 2, 2), rho_a).reshape(12, 12)
+        noise = 1e-6*rng.normal(size=(12, 12))
+        plan = get_plan((2, 3, 2), (1,))
+        limit = streaming.MAX_BLOCK_ELEMENTS
+        try:
+            for streaming.MAX_BLOCK_ELEMENTS in [limit, 24, 1]:
+                for matrix, expected in [(rho, True), (rho + noise + noise.T, False)]:
+                    rho_space = reduce_density(plan, matrix)
+                    rho_rest = reduce_density(get_plan((2, 3, 2), (0, 2)), matrix)
+                    self.assertEqual(expected, _is_product(
+                        plan, matrix, rho_space, rho_rest, np.trace(matrix), 1e-10))
+        finally:
+            streaming.MAX_BLOCK_ELEMENTS = limit
+
+
+class TestSparseState(unittest.TestCase):
+    def setUp(self):
+        self.pA = StateProp(state_type="light", truncation=6, wavelength=1550,
+                            polarization="H", bandwidth=1)
+        self.pB = StateProp(state_type="light", truncation=6, wavelength=1550,
+                            polarization="V", bandwidth=1)
+        self.adag = np.diag(np.sqrt(np.arange(1, 6)), -1)
+
+    def _states(self):
+        states = []
+        for sparse in (False, True):
+            A = State(self.pA, sparse=sparse)
+            A.join(State(self.pB, sparse=sparse))
+            states.append(A)
+        return states
+
+    def test_sparse_matches_dense(self):
+        dense, sparse = self._states()
+        loss = [np.diag([1, 0.9, 0.8, 0.7, 0.6, 0.5]),
+                np.diag(np.sqrt([0.1, 0.2, 0.3, 0.4, 0.5]), 1)]
+        for s in (dense, sparse):
+            s.apply_kraus_operators([self.adag/np.sqrt(1)], [self.pA])
+            s.apply_kraus_operators([np.kron(self.adag, np.eye(6))], [self.pB, self.pA])
+            s.apply_kraus_operators(loss, [self.pB])
+            s._reorder([self.pB, self.pA])
+        self.assertTrue(any(f.sparse for f in sparse.factors))
+        np.testing.assert_array_almost_equal(
+            dense.get_reduced_state([self.pA]), sparse.get_reduced_state([self.pA]))
+        np.testing.assert_array_almost_equal(dense.state, sparse.state)
+        self.assertIsInstance(sparse.state, np.ndarray)
+
+    def test_switches_to_dense(self):
+        _, sparse = self._states()
+        mix = np.ones((6, 6))/6
+        sparse.apply_kraus_operators([mix, mix @ np.diag([1, -1, 1, -1, 1, -1])],
+                                     [self.pA])
+        self.assertFalse(sparse.factors[0].sparse)
+        self.assertIsInstance(sparse.factors[0].matrix, np.ndarray)
+
+
+class TestPhotonBlockState(unittest.TestCase):
+    def setUp(self):
+        self.props = [
+            StateProp(state_type="light", truncation=4, wavelength=1550,
+                      polarization="H", bandwidth=1)
+            for _ in range(3)
+        ]
+        d = 4
+        adag = np.diag(np.sqrt(np.arange(1, d)), -1)
+        a = adag.T
+        # Beam splitter between two modes conserves the total photon number
+        H = np.kron(adag, a) + np.kron(a, adag)
+        w, v = np.linalg.eigh(H)
+        self.U = v @ np.diag(np.exp(-1j*w*np.pi/4)) @ v.conj().T
+        self.dephase = [np.diag([1, 1, 0, 0]), np.diag([0, 0, 1, 1])]
+        self.adag = adag
+
+    def _states(self):
+        states = []
+        for photon_blocks in (False, True):
+            s = State(self.props[0], photon_blocks=photon_blocks)
+            for p in self.props[1:]:
+                s.join(State(p, photon_blocks=photon_blocks))
+            s.split_tolerance = None
+            states.append(s)
+        return states
+
+    def test_blocks_match_dense(self):
+        dense, blocks = self._states()
+        pA, pB, pC = self.props
+        for s in (dense, blocks):
+            s.apply_kraus_operators([self.adag], [pA])
+            s.apply_kraus_operators([self.adag @ self.adag], [pC])
+            s.apply_kraus_operators([self.U], [pA, pB])
+            s.apply_kraus_operators(self.dephase, [pB])
+            s.apply_kraus_operators([self.U], [pC, pB])
+            s._reorder([pB, pC])
+        self.assertIsInstance(blocks.factors[0].matrix, PhotonBlocks)
+        np.testing.assert_array_almost_equal(
+            dense.get_reduced_state([pB, pC]), blocks.get_reduced_state([pB, pC]))
+        np.testing.assert_array_almost_equal(dense.state, blocks.state)
+
+    def test_non_conserving_channel_switches_to_dense(self):
+        _, blocks = self._states()
+        pA = self.props[0]
+        loss = [np.diag([1, 0.5, 0.5, 0.5]), np.diag(np.sqrt([0.75, 0.75, 0.75]), 1)]
+        blocks.apply_kraus_operators([self.adag], [pA])
+        blocks.apply_kraus_operators(self.dephase, [pA])
+        self.assertIsInstance(blocks.factors[0].matrix, PhotonBlocks)
+        blocks.apply_kraus_operators(loss, [pA])
+        self.assertIsInstance(blocks.factors[0].matrix, np.ndarray)
+        self.assertFalse(blocks.factors[0].photon_blocks)
+
+
+class TestLogicalReorder(unittest.TestCase):
+    def test_reorder_does_not_touch_data(self):
+        pA = StateProp(state_type="light", truncation=2, wavelength=1550,
+                       polarization="H", bandwidth=1)
+        pB = StateProp(state_type="internal", truncation=3)
+        A = State(pA)
+        A.join(State(pB))
+        A.split_tolerance = None
+        X = np.array([[0, 1], [1, 0]])
+        A.apply_kraus_operators([np.eye(2)/np.sqrt(2), X/np.sqrt(2)], [pA])
+        A.apply_kraus_operators([np.eye(6)], [pA, pB])
+        matrix = A.factors[0].matrix
+        A._reorder([pB, pA])
+        self.assertIs(A.factors[0].matrix, matrix)
+        self.assertEqual([p.uuid for p in A.factors[0].props], [pA.uuid, pB.uuid])
+        self.assertEqual([p.uuid for p in A.state_props], [pB.uuid, pA.uuid])
+        expected = np.kron(np.diag([1, 0, 0]), np.diag([0.5, 0.5]))
+        np.testing.assert_array_almost_equal(A.state, expected)
+
+
+class TestOutOfCoreState(unittest.TestCase):
+    def setUp(self):
+        self.block_elements = streaming.MAX_BLOCK_ELEMENTS
+        streaming.MAX_BLOCK_ELEMENTS = 64
+        self.pA = StateProp(state_type="light", truncation=3, wavelength=1550,
+                            polarization="H", bandwidth=1)
+        self.pB = StateProp(state_type="internal", truncation=4)
+        self.pC = StateProp(state_type="light", truncation=3, wavelength=1550,
+                            polarization="V", bandwidth=1)
+
+    def tearDown(self):
+        streaming.MAX_BLOCK_ELEMENTS = self.block_elements
+
+    def test_out_of_core_matches_dense(self):
+        rng = np.random.default_rng(4)
+        ops = rng.normal(size=(3, 12, 12)) + 1j*rng.normal(size=(3, 12, 12))
+        mix = [np.eye(3)/np.sqrt(2), np.roll(np.eye(3), 1, axis=0)/np.sqrt(2)]
+        states = []
+        for out_of_core in (False, True):
+            s = State(self.pA, out_of_core=out_of_core)
+            s.join(State(self.pB, out_of_core=out_of_core))
+            s.join(State(self.pC, out_of_core=out_of_core))
+            s.apply_kraus_operators(mix, [self.pA])
+            s.apply_kraus_operators(mix, [self.pC])
+            s.apply_kraus_operators(list(ops), [self.pC, self.pB])
+            s._reorder([self.pC, self.pB])
+            states.append(s)
+        dense, out_of_core = states
+        self.assertTrue(any(isinstance(f.matrix, np.memmap) for f in out_of_core.factors))
+        for spaces in ([self.pA], [self.pB], [self.pA, self.pC]):
+            np.testing.assert_array_almost_equal(
+                dense.get_reduced_state(spaces), out_of_core.get_reduced_state(spaces))
+        np.testing.assert_array_almost_equal(dense.state, out_of_core.state)
+
+
+class TestSharedState(unittest.TestCase):
+    def setUp(self):
+        self.block_elements = streaming.MAX_BLOCK_ELEMENTS
+        streaming.MAX_BLOCK_ELEMENTS = 64
+        shared.set_processes(2)
+        self.pA = StateProp(state_type="light", truncation=3, wavelength=1550,
+                            polarization="H", bandwidth=1)
+        self.pB = StateProp(state_type="internal", truncation=4)
+
+    def tearDown(self):
+        streaming.MAX_BLOCK_ELEMENTS = self.block_elements
+        shared.set_processes(None)
+
+    def test_split_keeps_storage(self):
+        pC = StateProp(state_type="light", truncation=3, wavelength=1550,
+                       polarization="V", bandwidth=1)
+        shift = np.roll(np.eye(3), 1, axis=0)
+        mix = [np.eye(9)/np.sqrt(2), np.kron(shift, shift)/np.sqrt(2)]
+        checks = {"sparse": sparse_ops.is_sparse, "out_of_core": streaming.is_memmap,
+                  "shared": shared.is_shared}
+        for flag, check in checks.items():
+            s = State(self.pA, **{flag: True})
+            s.join(State(self.pB, **{flag: True}))
+            s.join(State(pC, **{flag: True}))
+            # Product preserving two mode unitaries, A and C are split off again
+            s.apply_kraus_operators([np.kron(shift, np.eye(4))], [self.pA, self.pB])
+            s.apply_kraus_operators([np.kron(np.eye(4), shift)], [self.pB, pC])
+            self.assertEqual(len(s.factors), 3)
+            s.apply_kraus_operators(mix, [self.pA, pC])
+            factor = s.factors[s._factor_index(self.pA.uuid)]
+            self.assertTrue(getattr(factor, flag), flag)
+            self.assertTrue(check(factor.matrix), flag)
+
+    def test_shared_matches_dense(self):
+        rng = np.random.default_rng(5)
+        ops = rng.normal(size=(2, 12, 12)) + 1j*rng.normal(size=(2, 12, 12))
+        mix = [np.eye(3)/np.sqrt(2), np.roll(np.eye(3), 1, axis=0)/np.sqrt(2)]
+        states = []
+        for use_shared in (False, True):
+            s = State(self.pA, shared=use_shared)
+            s.join(State(self.pB, shared=use_shared))
+            s.apply_kraus_operators(list(ops), [self.pA, self.pB])
+            s.apply_kraus_operators(mix, [self.pA])
+            states.append(s)
+        dense, sharded = states
+        self.assertTrue(shared.is_shared(sharded.factors[0].matrix))
+        for spaces in ([self.pA], [self.pB]):
+            np.testing.assert_array_almost_equal(
+                dense.get_reduced_state(spaces), sharded.get_reduced_state(spaces))
+        np.testing.assert_array_almost_equal(dense.state, sharded.state)
+
+
+class TestDiscard(unittest.TestCase):
+    def setUp(self):
+        self.pA = StateProp(state_type="light", truncation=3, wavelength=1550,
+                            polarization="H", bandwidth=1)
+        self.pB = StateProp(state_type="internal", truncation=2)
+        self.pC = StateProp(state_type="light", truncation=2, wavelength=1550,
+                            polarization="V", bandwidth=1)
+        rng = np.random.default_rng(6)
+        self.ops = list(rng.normal(size=(2, 6, 6)) + 1j*rng.normal(size=(2, 6, 6)))
+
+    def test_collect_traces_out_in_one_batch(self):
+        s = State(self.pA)
+        s.join(State(self.pB))
+        s.join(State(self.pC))
+        s.apply_kraus_operators(self.ops, [self.pA, self.pB])
+        s.apply_kraus_operators([np.array([[0, 1], [1, 0]])], [self.pC])
+        expected = s.get_reduced_state([self.pB])
+        s.discard([self.pA])
+        s.discard([self.pC])
+        self.assertEqual(len(s.state_props), 3)
+        s.collect()
+        self.assertEqual(s.state_props, [self.pB])
+        self.assertEqual(s.dimensions, 2)
+        self.assertEqual(s.discarded, set())
+        np.testing.assert_array_almost_equal(s.state, expected)
+
+    def test_discarded_factor_keeps_trace(self):
+        s = State(self.pA)
+        s.join(State(self.pB))
+        s.join(State(self.pC))
+        s.apply_kraus_operators(self.ops, [self.pA, self.pB])
+        expected = s.get_reduced_state([self.pC])
+        s.discard([self.pA, self.pB])
+        s.collect()
+        self.assertEqual(len(s.factors), 1)
+        np.testing.assert_array_almost_equal(s.state, expected)
+
+    def test_discarded_spaces_are_not_sent(self):
+        s = State(self.pA)
+        s.join(State(self.pB))
+        s.discard([self.pA])
+        message = s.to_message()
+        self.assertEqual([p["uuid"] for p in message["state_props"]], [self.pB.uuid])
+        self.assertEqual(json_to_numpy(message["state"]).shape, (2, 2))
+
+
+class TestAdaptiveTruncation(unittest.TestCase):
+    def setUp(self):
+        self.pA = StateProp(state_type="light", truncation=6, wavelength=1550,
+                            polarization="H", bandwidth=1)
+        self.pB = StateProp(state_type="internal", truncation=2)
+
+    def tearDown(self):
+        State.truncation_threshold = None
+        State.max_truncation = None
+
+    def test_shrink_reports_discarded_weight(self):
+        s = State(self.pA)
+        s.join(State(self.pB))
+        psi = np.array([np.sqrt(0.7), np.sqrt(0.3 - 1e-12), 0, np.sqrt(1e-12), 0, 0])
+        U = np.eye(6, dtype=complex)
+        U[:, 0] = psi
+        U, _ = np.linalg.qr(U)
+        U = U*np.sign(U[0, 0]/psi[0])
+        s.apply_kraus_operators([np.kron(U, np.eye(2))], [self.pA, self.pB])
+        discarded = s.adapt_truncation(threshold=1e-10)
+        A = s.get_props(self.pA.uuid)
+        self.assertEqual(A.truncation, 3)
+        self.assertEqual(s.dimensions, 6)
+        self.assertAlmostEqual(discarded[self.pA.uuid]*1e12, 1)
+        self.assertEqual(s.state.shape, (6, 6))
+        np.testing.assert_array_almost_equal(
+            np.diagonal(s.get_reduced_state([A])).real, [0.7, 0.3, 0])
+        self.assertEqual(State.from_message(s.to_message()).get_props(A.uuid).truncation, 3)
+
+    def test_grow_and_automatic_adaptation(self):
+        State.truncation_threshold = 1e-10
+        State.max_truncation = 4
+        s = State(self.pA)
+        creation = np.diag(np.sqrt(np.arange(1, 6)), -1)
+        s.apply_kraus_operators([creation], [self.pA])
+        self.assertEqual(s.get_props(self.pA.uuid).truncation, 3)
+        A = s.get_props(self.pA.uuid)
+        s.apply_kraus_operators([creation[:3, :3]], [A])
+        A = s.get_props(self.pA.uuid)
+        self.assertEqual(A.truncation, 4)
+        s.apply_kraus_operators([creation[:4, :4]], [A])
+        self.assertEqual(s.get_props(self.pA.uuid).truncation, 4)
+
+
+class TestPrecision(unittest.TestCase):
+    def setUp(self):
+        self.pA = StateProp(state_type="light", truncation=3, wavelength=1550,
+                            polarization="H", bandwidth=1)
+        self.pB = StateProp(state_type="internal", truncation=2)
+
+    def tearDown(self):
+        precision.set_precision("complex128")
+
+    def test_single_precision(self):
+        precision.set_precision("complex64")
+        A = State(self.pA)
+        A.join(State(self.pB))
+        A.apply_kraus_operators([np.roll(np.eye(3), 1, axis=0)], [self.pA])
+        A.apply_kraus_operators([np.diag([1, 0]), np.diag([0, 1])], [self.pB])
+        self.assertEqual(A.get_reduced_state([self.pA]).dtype, np.complex64)
+        self.assertEqual(A.state.dtype, np.complex64)
+        self.assertEqual(json_to_numpy(numpy_to_json(A.state)).dtype, np.complex64)
+
+    def test_single_precision_sparse(self):
+        precision.set_precision("complex64")
+        pA = StateProp(state_type="internal", truncation=8)
+        pB = StateProp(state_type="internal", truncation=4)
+        A = State(pA, sparse=True)
+        A.join(State(pB, sparse=True))
+        shift = np.roll(np.eye(8), 1, axis=0)
+        A.apply_kraus_operators([np.kron(shift, np.eye(4))], [pA, pB])
+        A.apply_kraus_operators([np.eye(8)/np.sqrt(2), shift/np.sqrt(2)], [pA])
+        A.apply_kraus_operators([np.kron(np.eye(8), np.roll(np.eye(4), 1, axis=0))],
+                                [pA, pB])
+        factor = A.factors[A._factor_index(pA.uuid)]
+        self.assertTrue(sparse_ops.is_sparse(factor.matrix))
+        self.assertEqual(factor.matrix.dtype, np.complex64)
+        self.assertEqual(A.get_reduced_state([pA]).dtype, np.complex64)
+        self.assertEqual(A.state.dtype, np.complex64)
+
+    def test_drift_check(self):
+        precision.set_precision("complex128", check_drift=True)
+        A = State(self.pA)
+        A.apply_kraus_operators([np.eye(3)/np.sqrt(2), np.eye(3)/np.sqrt(2)], [self.pA])
+        with self.assertWarns(precision.DriftWarning):
+            A.apply_kraus_operators([np.eye(3)/np.sqrt(2)], [self.pA])
+        self.assertAlmostEqual(A.drift()[0], 0.5)
+
+    def test_unknown_precision(self):
+        with self.assertRaises(ValueError):
+            precision.set_precision("float16")
+
+
+class TestSubsystemIndex(unittest.TestCase):
+    def setUp(self):
+        self.props = [StateProp(state_type="internal", truncation=2, uuid=str(i))
+                      for i in range(4)]
+
+    def test_index_follows_join_and_reorder(self):
+        A = State(self.props[0])
+        for p in self.props[1:]:
+            A.join(State(p))
+        self.assertEqual([A.get_index(str(i)) for i in range(4)], [0, 1, 2, 3])
+        A._reorder([self.props[3], self.props[1]])
+        self.assertEqual(A.get_index("3"), 0)
+        self.assertEqual(A.get_index("0"), 2)
+        self.assertIs(A.get_props("1"), self.props[1])
+        self.assertEqual(A.get_all_props(["2", "x", "0"]), [self.props[2], self.props[0]])
+
+    def test_index_after_message(self):
+        A = State(self.props[0])
+        A.join(State(self.props[1]))
+        B = State.from_message(A.to_message())
+        self.assertEqual(B.get_index("1"), 1)
+        self.assertEqual(B.get_props("0").truncation, 2)
+
+    def test_state_prop_is_frozen_and_hashable(self):
+        p = StateProp(state_type="light", truncation="3", wavelength=1550,
+                      polarization="H", bandwidth=1)
+        self.assertEqual(p.truncation, 3)
+        self.assertIsInstance(p.wavelength, float)
+        with self.assertRaises(AttributeError):
+            p.truncation = 4
+        self.assertEqual(len({p, StateProp(**p.dict())}), 1)
+        self.assertEqual(StateProp(**p.dict()), p)
+
+
+class TestStateInput(unittest.TestCase):
+    def setUp(self):
+        self.props = [StateProp(state_type="internal", truncation=2 + i, uuid=str(i))
+                      for i in range(3)]
+        self.state = State(self.props[0])
+        for p in self.props[1:]:
+            self.state.join(State(p))
+        rng = np.random.default_rng(7)
+        self.ops = list(rng.normal(size=(2, 6, 6)) + 1j*rng.normal(size=(2, 6, 6)))
+        self.state.apply_kraus_operators(self.ops, [self.props[0], self.props[1]])
+        self.ports = {"input": "1", "control": ["2"]}
+
+    def test_props_only(self):
+        message = self.state.to_message(self.ports, state_input="props")
+        self.assertNotIn("state", message)
+        self.assertEqual([p["uuid"] for p in message["state_props"]], ["1", "2"])
+        self.assertEqual(message["dimensions"], 12)
+        s = State.from_message(message)
+        self.assertEqual(s.get_props("2").truncation, 4)
+
+    def test_reduced(self):
+        message = self.state.to_message(self.ports, state_input="reduced")
+        s = State.from_message(message)
+        np.testing.assert_array_almost_equal(
+            s.state, self.state.get_reduced_state([self.props[1], self.props[2]]))
+
+    def test_reduced_with_swapped_ports(self):
+        pA = StateProp(state_type="internal", truncation=2, uuid="A")
+        pB = StateProp(state_type="internal", truncation=3, uuid="B")
+        state = State(pA)
+        state.join(State(pB))
+        state.apply_kraus_operators([np.array([[0, 1], [1, 0]])], [pA])
+        state.apply_kraus_operators([np.eye(2)/np.sqrt(2)]*2, [pA])
+        message = state.to_message({"in0": "B", "in1": "A"}, state_input="reduced")
+        s = State.from_message(message)
+        np.testing.assert_array_almost_equal(
+            s.get_reduced_state([s.get_props("B")]), np.diag([1, 0, 0]))
+        np.testing.assert_array_almost_equal(
+            s.get_reduced_state([s.get_props("A")]), np.diag([0, 1]))
+
+    def test_unknown_input(self):
+        with self.assertRaises(ValueError):
+            self.state.to_message(self.ports, state_input="vector")
+
+
+class TestLazyMessage(unittest.TestCase):
+    def setUp(self):
+        self.props = [StateProp(state_type="internal", truncation=2, uuid=str(i))
+                      for i in range(2)]
+        self.state = State(self.props[0])
+        self.state.join(State(self.props[1]))
+        self.state.apply_kraus_operators([np.array([[0, 1], [1, 0]])], [self.props[1]])
+
+    def test_props_without_decoding(self):
+        message = self.state.to_message()
+        message["state"] = "not decodable"
+        s = State.from_message(message)
+        self.assertEqual(s.get_props("1").truncation, 2)
+        self.assertEqual(s.get_index("1"), 1)
+        with self.assertRaises(ValueError):
+            s.state
+
+    def test_decoded_on_access(self):
+        s = State.from_message(self.state.to_message())
+        self.assertIsNotNone(s._payload)
+        np.testing.assert_array_almost_equal(s.state, self.state.state)
+        self.assertIsNone(s._payload)
+        s.apply_kraus_operators([np.array([[0, 1], [1, 0]])], [s.get_props("1")])
+        self.assertAlmostEqual(s.state[0, 0], 1)
+
+    def test_reorder_before_decoding(self):
+        s = State.from_message(self.state.to_message())
+        s._reorder([s.get_props("1")])
+        np.testing.assert_array_almost_equal(
+            s.get_reduced_state([s.get_props("1")]), np.diag([0, 1]))
+        np.testing.assert_array_almost_equal(
+            s.get_reduced_state([s.get_props("0")]), np.diag([1, 0]))
+
+    def test_props_only_message(self):
+        message = self.state.to_message({"input": "1"}, state_input="props")
+        s = State.from_message(message)
+        with self.assertRaisesRegex(ValueError, "no state"):
+            s.state
+
+
 if __name__ == "__main__":
     unittest.main()
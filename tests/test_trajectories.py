@@ -0,0 +1,96 @@
+import unittest
+
+import numpy as np
+
+from qsi.state import State, StateProp
+from qsi.trajectories import TrajectoryState, run_trajectories
+
+
+class TestTrajectories(unittest.TestCase):
+    def setUp(self):
+        self.pA = StateProp(state_type="light", truncation=3, wavelength=1550,
+                            polarization="H", bandwidth=1, uuid="A")
+        self.pB = StateProp(state_type="internal", truncation=2, uuid="B")
+        # Photon loss with transmissivity 0.6
+        loss = [np.diag([1, np.sqrt(0.6), 0.6]),
+                np.diag([np.sqrt(0.4), np.sqrt(0.48)], 1),
+                np.diag([0.4], 2)]
+        hadamard = np.array([[1, 1], [1, -1]])/np.sqrt(2)
+        # Adds a photon (cyclically) if the internal state is 1
+        controlled_shift = (np.kron(np.eye(3), np.diag([1, 0])) +
+                            np.kron(np.roll(np.eye(3), 1, axis=0), np.diag([0, 1])))
+        self.channels = [
+            ([hadamard], [self.pB]),
+            ([controlled_shift], [self.pA, self.pB]),
+            (loss, [self.pA]),
+        ]
+
+    def initial_state(self):
+        state = State(self.pA)
+        state.join(State(self.pB))
+        return state
+
+    def exact_state(self):
+        state = self.initial_state()
+        for operators, spaces in self.channels:
+            state.apply_kraus_operators(operators, spaces)
+        return state
+
+    def test_single_trajectory_stays_normalized(self):
+        state = self.initial_state()
+        trajectory = TrajectoryState(state.vector, state.state_props,
+                                     np.random.default_rng(1))
+        for operators, spaces in self.channels:
+            trajectory.apply_kraus_operators(operators, spaces)
+        self.assertAlmostEqual(np.linalg.norm(trajectory.vector), 1)
+        self.assertAlmostEqual(np.trace(trajectory.get_reduced_state([self.pB])).real, 1)
+
+    def test_annihilating_channel(self):
+        state = State(self.pB)
+        trajectory = TrajectoryState(state.vector, state.state_props,
+                                     np.random.default_rng(1))
+        with self.assertRaises(ValueError):
+            trajectory.apply_kraus_operators([np.diag([0, 1])], [self.pB])
+
+    def test_ensemble_matches_density_matrix(self):
+        number = np.diag([0, 1, 2])
+        result = run_trajectories(
+            self.initial_state(), self.channels, 2000, reduced=[self.pA],
+            observables={"n": (number, [self.pA])}, workers=2, seed=7)
+        exact = self.exact_state()
+        rho = exact.get_reduced_state([self.pA])
+        expected = np.trace(number @ rho).real
+        self.assertEqual(result.n_trajectories, 2000)
+        self.assertTrue(np.all(np.abs(result.reduced_state - rho) < 0.05))
+        lo, hi = result.interval("n")
+        self.assertLess(hi - lo, 0.1)
+        self.assertLess(abs(result.observables["n"] - expected),
+                        5*result.observable_errors["n"])
+
+    def test_reproducible_with_seed(self):
+        kwargs = dict(reduced=[self.pB], workers=1, seed=3)
+        a = run_trajectories(self.initial_state(), self.channels, 50, **kwargs)
+        b = run_trajectories(self.initial_state(), self.channels, 50, **kwargs)
+        self.assertTrue(np.allclose(a.reduced_state, b.reduced_state))
+
+    def test_input_state_is_not_modified(self):
+        state = self.initial_state()
+        state.apply_kraus_operators([np.array([[0, 1], [1, 0]])], [self.pB])
+        order = [self.pB, self.pA]
+        state._reorder(order)
+        result = run_trajectories(state, [], 20, reduced=[self.pB], workers=1, seed=0)
+        self.assertEqual(len(state.factors), 2)
+        self.assertTrue(np.allclose(result.reduced_state, np.diag([0, 1])))
+
+    def test_mixed_initial_state(self):
+        state = self.initial_state()
+        state.apply_kraus_operators([np.array([[1, 0], [1, 0]])/np.sqrt(2)], [self.pB])
+        state.apply_kraus_operators([np.sqrt(0.7)*np.eye(2), np.sqrt(0.3)*np.diag([1, -1])],
+                                    [self.pB])
+        result = run_trajectories(state, [], 2000, reduced=[self.pB], workers=1, seed=0)
+        self.assertTrue(np.all(
+            np.abs(result.reduced_state - state.get_reduced_state([self.pB])) < 0.05))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+import gc
+import json
+import unittest
+from multiprocessing import shared_memory
+
+import numpy as np
+from jsonschema import validate
+
+from qsi import wire
+from qsi.helpers import json_to_kraus
+from qsi.messages import SCHEMAS
+
+
+class TestWireFormat(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        self.rho = rng.normal(size=(6, 6)) + 1j*rng.normal(size=(6, 6))
+        self.ops = [np.eye(3, dtype=np.complex64), np.ones((3, 3))]
+
+    def test_json_fallback(self):
+        message = {"msg_type": "param_query", "sent_from": 1}
+        payload, metadata = wire.encode(message)
+        self.assertFalse(wire.is_binary(payload))
+        self.assertEqual(json.loads(payload), message)
+        self.assertEqual(wire.decode(bytearray(payload)), message)
+
+    def test_round_trip(self):
+        message = {"msg_type": "channel_query", "state": self.rho,
+                   "state_props": [{"uuid": "a"}]}
+        payload, metadata = wire.encode(message)
+        self.assertTrue(wire.is_binary(payload))
+        self.assertEqual(metadata["state"], {"__array__": 0})
+        decoded = wire.decode(bytearray(payload))
+        np.testing.assert_array_equal(decoded["state"], self.rho)
+        self.assertEqual(decoded["state_props"], [{"uuid": "a"}])
+
+    def test_layout(self):
+        big_endian = self.rho.astype(">c16")
+        payload, _ = wire.encode({"state": big_endian, "ops": self.ops})
+        _, _, length = wire.HEADER.unpack_from(payload)
+        frame = json.loads(payload[wire.HEADER.size:wire.HEADER.size + length])
+        start = wire.HEADER.size + length
+        self.assertEqual(start % wire.ALIGNMENT, 0)
+        for buffer in frame["__buffers__"]:
+            self.assertEqual(buffer["offset"] % wire.ALIGNMENT, 0)
+            self.assertIn(buffer["dtype"][0], "<|")
+        decoded = wire.decode(bytearray(payload))
+        np.testing.assert_array_equal(decoded["state"], self.rho)
+        self.assertEqual(decoded["ops"][0].dtype, np.complex64)
+
+    def test_kraus_response(self):
+        message = {"msg_type": "channel_query_response", "sent_from": 1,
+                   "kraus_operators": self.ops, "kraus_state_indices": ["a"],
+                   "error": 0}
+        payload, metadata = wire.encode(message)
+        validate(instance=metadata, schema=SCHEMAS["channel_query_response"])
+        decoded = wire.decode(bytearray(payload))
+        for K, L in zip(self.ops, json_to_kraus(decoded["kraus_operators"])):
+            np.testing.assert_array_equal(K, L)
+
+
+class TestSharedTransport(unittest.TestCase):
+    def setUp(self):
+        self.threshold = wire.SHARED_THRESHOLD
+        wire.SHARED_THRESHOLD = 256
+        rng = np.random.default_rng(2)
+        self.rho = rng.normal(size=(8, 8)) + 1j*rng.normal(size=(8, 8))
+        self.small = np.eye(2)
+
+    def tearDown(self):
+        wire.SHARED_THRESHOLD = self.threshold
+
+    def test_hand_over(self):
+        segments = []
+        payload, _ = wire.encode({"state": self.rho, "small": self.small}, segments)
+        self.assertEqual(len(segments), 1)
+        self.assertLess(len(payload), self.rho.nbytes)
+        name = segments[0].name
+        wire.hand_over(segments)
+        decoded = wire.decode(bytearray(payload))
+        np.testing.assert_array_equal(decoded["state"], self.rho)
+        np.testing.assert_array_equal(decoded["small"], self.small)
+        # The segment is released with the decoded array
+        del decoded
+        gc.collect()
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+    def test_release(self):
+        segments = []
+        wire.encode({"state": self.rho}, segments)
+        name = segments[0].name
+        wire.release(segments)
+        with self.assertRaises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+
+
+if __name__ == "__main__":
+    unittest.main()